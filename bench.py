@@ -0,0 +1,175 @@
+"""Benchmarks of the trading pipeline on synthetic data (``python bench.py``).
+
+Compared against a stored baseline so CI can fail on a regression; see
+``python bench.py --help``.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+import strm
+from strm import (
+    DEFAULT_PARAMS, INTRADAY_INTERVAL, IntradayFeatures, MetadataStore, QuoteCache, SyntheticProvider,
+    TradeLedger, close_trade, execute_trade, fetch_quote, get_trading_opportunities
+)
+
+# Tracked benchmark results from `python bench.py --save-baseline`, compared on later runs
+BENCH_BASELINE_PATH = os.environ.get('STRM_BENCH_BASELINE',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench', 'baseline.json'))
+# Relative slowdown (or memory growth) over the baseline reported as a regression
+BENCH_TOLERANCE = 0.20
+
+@contextmanager
+def _environ(**overrides):
+    """Temporarily set environment variables, e.g. to configure dashboard runs under AppTest"""
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def bench_scan(symbol_count):
+    """Cold-cache scan of ``symbol_count`` synthetic symbols; returns symbols/sec"""
+    provider = SyntheticProvider()
+    provider.intraday = IntradayFeatures() if INTRADAY_INTERVAL else None
+    store = MetadataStore(fetch=provider.get_metadata)
+    cache = QuoteCache(fetch=partial(fetch_quote, provider=provider, metadata_store=store))
+    symbols = [f"SYN{i:05d}.NS" for i in range(symbol_count)]
+    start = time.perf_counter()
+    get_trading_opportunities(symbols, DEFAULT_PARAMS['BUY_THRESHOLD'], DEFAULT_PARAMS['SELL_THRESHOLD'],
+                              fetch=cache.get)
+    return symbol_count / (time.perf_counter() - start)
+
+def bench_ledger(trade_count):
+    """Open then close ``trade_count`` trades on a fresh ledger; returns (opens/sec, closes/sec)"""
+    amount = DEFAULT_PARAMS['AMOUNT_PER_TRADE']
+    ledger = TradeLedger(balance=amount * trade_count)
+    rng = np.random.default_rng(0)
+    symbols = [f"SYN{i:05d}.NS" for i in range(100)]
+    prices = rng.uniform(50, 5000, trade_count)
+    sides = np.where(rng.random(trade_count) < 0.5, 'BUY', 'SELL')
+    
+    start = time.perf_counter()
+    for i in range(trade_count):
+        execute_trade(symbols[i % 100], sides[i], prices[i], symbols[i % 100], amount,
+                      DEFAULT_PARAMS['STOP_LOSS_PCT'], DEFAULT_PARAMS['TAKE_PROFIT_PCT'], ledger=ledger)
+    opened = time.perf_counter() - start
+    
+    exit_prices = prices * rng.uniform(0.97, 1.03, trade_count)
+    start = time.perf_counter()
+    for trade_id in ledger.open_ids():
+        close_trade(trade_id, ledger=ledger, price=exit_prices[trade_id])
+    closed = time.perf_counter() - start
+    return trade_count / opened, trade_count / closed
+
+def bench_render(runs):
+    """Headless AppTest runs of the dashboard on synthetic data; returns (cold, warm median) seconds"""
+    from streamlit.testing.v1 import AppTest
+    
+    with tempfile.TemporaryDirectory() as workdir, \
+            _environ(STRM_PROVIDER='synthetic', STRM_JOURNAL=os.path.join(workdir, 'trades.db')):
+        app = AppTest.from_file(strm.__file__, default_timeout=120)
+        start = time.perf_counter()
+        app.run()
+        cold = time.perf_counter() - start
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+        warm = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            app.run()
+            warm.append(time.perf_counter() - start)
+    return cold, float(np.median(warm)) if warm else np.nan
+
+def run_benchmarks(symbol_count=500, trade_counts=(1_000, 100_000), render_runs=5):
+    """Run the benchmark suite; returns a flat dict of metric -> value.
+
+    Throughput metrics end in ``_per_sec`` (higher is better); times end in
+    ``_seconds`` and peak traced allocations in ``_peak_mb`` (lower is better).
+    """
+    results = {}
+    
+    def measure(name, bench, *args):
+        value = bench(*args)
+        # Tracing slows allocation-heavy code several-fold, so peak memory comes
+        # from a second, traced pass rather than from the timed one
+        tracemalloc.start()
+        try:
+            bench(*args)
+            results[f"{name}_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+        return value
+    
+    results['scan_symbols_per_sec'] = measure('scan', bench_scan, symbol_count)
+    for count in trade_counts:
+        opens, closes = measure(f"ledger_{count}", bench_ledger, count)
+        results[f"execute_{count}_per_sec"] = opens
+        results[f"close_{count}_per_sec"] = closes
+    if render_runs:
+        cold, warm = measure('render', bench_render, render_runs)
+        results['render_cold_seconds'] = cold
+        results['render_warm_seconds'] = warm
+    return results
+
+def compare_benchmarks(results, baseline, tolerance=BENCH_TOLERANCE):
+    """Frame of metric, baseline, current, change_pct and regression against a baseline dict"""
+    rows = []
+    for metric, current in results.items():
+        previous = baseline.get(metric)
+        if previous is None or not previous:
+            rows.append((metric, previous, current, np.nan, False))
+            continue
+        change = (current - previous) / previous
+        # Throughput regresses when it drops; times and memory when they grow
+        worse = -change if metric.endswith('_per_sec') else change
+        rows.append((metric, previous, current, change * 100, worse > tolerance))
+    return pd.DataFrame(rows, columns=['metric', 'baseline', 'current', 'change_pct', 'regression'])
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data against a stored baseline")
+    parser.add_argument('--symbols', type=int, default=500, help="symbols in the scan throughput run")
+    parser.add_argument('--trades', type=_int_list, default=[1_000, 100_000], help="comma-separated ledger sizes")
+    parser.add_argument('--render-runs', type=int, default=5, help="warm dashboard reruns; 0 skips the render benchmark")
+    parser.add_argument('--baseline', default=BENCH_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE)
+    args = parser.parse_args(argv)
+    
+    results = run_benchmarks(args.symbols, args.trades, args.render_runs)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report = compare_benchmarks(results, baseline, args.tolerance)
+    print(report.to_string(index=False, float_format=lambda v: f"{v:,.3f}"))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one")
+    elif report['regression'].any():
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(report.loc[report['regression'], 'metric'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
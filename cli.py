@@ -0,0 +1,62 @@
+"""Offline tools for the order book imbalance trader (``python cli.py sweep|sync``)"""
+import argparse
+
+from strm import (
+    BACKTEST_FEE_BPS, BACKTEST_SLIPPAGE_BPS, DEFAULT_PARAMS, DEFAULT_UNIVERSE,
+    BarStore, get_provider, load_bars, load_universe, run_sweep
+)
+
+def _float_list(value):
+    return [float(v) for v in value.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline tools for the order book imbalance trader")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sweep = commands.add_parser('sweep', help="grid-search strategy parameters over historical bars")
+    sweep.add_argument('--universe', default=DEFAULT_UNIVERSE)
+    sweep.add_argument('--period', default='max')
+    sweep.add_argument('--interval', default='1d')
+    sweep.add_argument('--stop-loss', type=_float_list, default=[DEFAULT_PARAMS['STOP_LOSS_PCT']])
+    sweep.add_argument('--take-profit', type=_float_list, default=[DEFAULT_PARAMS['TAKE_PROFIT_PCT']])
+    sweep.add_argument('--buy', type=_float_list, default=[DEFAULT_PARAMS['BUY_THRESHOLD']])
+    sweep.add_argument('--sell', type=_float_list, default=[DEFAULT_PARAMS['SELL_THRESHOLD']],
+                       help="comma-separated values; write negatives as --sell=-0.2,-0.3")
+    sweep.add_argument('--fee-bps', type=float, default=BACKTEST_FEE_BPS)
+    sweep.add_argument('--slippage-bps', type=float, default=BACKTEST_SLIPPAGE_BPS)
+    sweep.add_argument('--workers', type=int, default=None)
+    sweep.add_argument('--top', type=int, default=20)
+    sweep.add_argument('--store', action='store_true', help="read bars from the local bar store, syncing the tail first")
+    
+    sync = commands.add_parser('sync', help="download missing bars into the local bar store")
+    sync.add_argument('--universe', default=DEFAULT_UNIVERSE)
+    sync.add_argument('--period', default='max', help="history to fetch for symbols not yet stored")
+    sync.add_argument('--interval', default='1d')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'sync':
+        store = BarStore()
+        for symbol in load_universe(args.universe):
+            try:
+                print(f"{symbol}: +{store.sync(symbol, get_provider(), interval=args.interval, period=args.period)} bars")
+            except Exception as e:
+                print(f"{symbol}: failed ({e})")
+    elif args.command == 'sweep':
+        bars = load_bars(load_universe(args.universe), period=args.period, interval=args.interval,
+                         store=BarStore() if args.store else None)
+        results = run_sweep(
+            bars,
+            {
+                'stop_loss_pct': args.stop_loss,
+                'take_profit_pct': args.take_profit,
+                'buy_threshold': args.buy,
+                'sell_threshold': args.sell
+            },
+            max_workers=args.workers,
+            fee_bps=args.fee_bps,
+            slippage_bps=args.slippage_bps
+        )
+        print(results.head(args.top).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
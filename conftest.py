@@ -0,0 +1 @@
+"""Lets the test suite import strm from the repository root"""
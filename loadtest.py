@@ -0,0 +1,163 @@
+"""Load test: concurrent dashboard sessions against a local server (``python loadtest.py``)"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import strm
+
+def _read_prometheus(path):
+    """Parse a Prometheus text file into {'name{labels}': value}"""
+    samples = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    name, value = line.rsplit(' ', 1)
+                    samples[name] = float(value)
+    return samples
+
+def _upstream_counts(metrics_path):
+    samples = _read_prometheus(metrics_path)
+    return {
+        'quote_fetches': samples.get('strm_stage_seconds_count{stage="upstream_quote"}', 0),
+        'history_calls': samples.get('strm_upstream_history_calls', 0),
+        'metadata_calls': samples.get('strm_upstream_metadata_calls', 0)
+    }
+
+async def _load_session(url, reruns, latencies, errors):
+    """One simulated browser tab: connect, then request ``reruns`` full-script reruns"""
+    from tornado.websocket import websocket_connect
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    
+    connection = await websocket_connect(url)
+    try:
+        for _ in range(reruns):
+            request = BackMsg()
+            request.rerun_script.query_string = ''
+            start = time.perf_counter()
+            await connection.write_message(request.SerializeToString(), binary=True)
+            while True:
+                data = await connection.read_message()
+                if data is None:
+                    raise ConnectionError("server closed the session")
+                message = ForwardMsg()
+                message.ParseFromString(data)
+                kind = message.WhichOneof('type')
+                if kind == 'script_finished':
+                    break
+                if (kind == 'delta' and message.delta.WhichOneof('type') == 'new_element'
+                        and message.delta.new_element.WhichOneof('type') == 'exception'):
+                    errors.append(message.delta.new_element.exception.message)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connection.close()
+
+async def _load_level(url, sessions, reruns, process):
+    """Run ``sessions`` concurrent sessions while sampling the server's RSS"""
+    latencies, errors, rss = [], [], [process.memory_info().rss]
+    tasks = [asyncio.create_task(_load_session(url, reruns, latencies, errors)) for _ in range(sessions)]
+    while not all(task.done() for task in tasks):
+        await asyncio.sleep(0.1)
+        rss.append(process.memory_info().rss)
+    for task in tasks:
+        task.result()
+    return latencies, errors, max(rss)
+
+def run_load_test(session_counts=(1, 2, 4, 8), reruns=5, latency_ms=50.0):
+    """Drive concurrent dashboard sessions against a local `streamlit run` server.
+
+    The server runs strm.py on the synthetic provider in a subprocess, and each
+    session is a websocket client speaking Streamlit's browser protocol, so
+    sessions share the server's caches and quote engine exactly as real tabs
+    do. Each level opens that many sessions at once, each requesting
+    ``reruns`` full-script reruns. Upstream counts are read back from the
+    server's own Prometheus export.
+
+    Returns one row per level with rerun latency percentiles (ms), server CPU
+    utilisation and peak RSS, and the upstream fetches made during the level.
+    """
+    import psutil
+    import socket
+    import subprocess
+    import urllib.request
+    
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+    
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        metrics_path = os.path.join(workdir, 'metrics.prom')
+        export_seconds = 0.5
+        env = dict(os.environ, STRM_PROVIDER='synthetic', STRM_SYNTHETIC_LATENCY_MS=str(latency_ms),
+                   STRM_JOURNAL=os.path.join(workdir, 'trades.db'), STRM_METRICS_FILE=metrics_path,
+                   STRM_METRICS_EXPORT_SECONDS=str(export_seconds))
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'streamlit', 'run', strm.__file__,
+             '--server.headless', 'true', '--server.port', str(port),
+             '--server.enableCORS', 'false', '--server.enableXsrfProtection', 'false'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=1)
+                    break
+                except OSError:
+                    if server.poll() is not None or time.time() > deadline:
+                        raise RuntimeError("streamlit server did not start")
+                    time.sleep(0.2)
+            
+            process = psutil.Process(server.pid)
+            url = f"ws://localhost:{port}/_stcore/stream"
+            for sessions in session_counts:
+                before = _upstream_counts(metrics_path)
+                process.cpu_percent()
+                latencies, errors, peak_rss = asyncio.run(_load_level(url, sessions, reruns, process))
+                cpu = process.cpu_percent()
+                # Let the exporter publish this level's counts before reading them
+                time.sleep(export_seconds * 3)
+                after = _upstream_counts(metrics_path)
+                
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+                rows.append({
+                    'sessions': sessions,
+                    'reruns': len(latencies),
+                    'errors': len(errors),
+                    'p50_ms': p50,
+                    'p95_ms': p95,
+                    'p99_ms': p99,
+                    'max_ms': max(latencies) * 1000,
+                    'cpu_pct': cpu,
+                    'peak_rss_mb': peak_rss / 2**20,
+                    **{name: after[name] - before[name] for name in after}
+                })
+        finally:
+            server.terminate()
+            server.wait()
+    return pd.DataFrame(rows)
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent dashboard sessions against a local server")
+    parser.add_argument('--sessions', type=_int_list, default=[1, 2, 4, 8],
+                        help="comma-separated concurrent session counts, one level each")
+    parser.add_argument('--reruns', type=int, default=5, help="full-script reruns per session")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="simulated upstream latency per request")
+    args = parser.parse_args(argv)
+    
+    report = run_load_test(args.sessions, args.reruns, args.latency_ms)
+    print(report.to_string(index=False, float_format=lambda v: f"{v:,.1f}"))
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,23 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
+import atexit
+import bisect
+import heapq
+import io
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-
-# Initialize session state
-if 'trades' not in st.session_state:
-    st.session_state.trades = []
-if 'balance' not in st.session_state:
-    st.session_state.balance = 100000.00  # Changed to INR (1 lakh)
-if 'auto_trading' not in st.session_state:
-    st.session_state.auto_trading = False
-if 'order_book_data' not in st.session_state:
-    st.session_state.order_book_data = pd.DataFrame()
+from functools import partial, wraps
 
 # Default trading parameters - converted to INR and adjusted amounts
 DEFAULT_PARAMS = {
@@ -24,23 +30,243 @@ DEFAULT_PARAMS = {
     'SELL_THRESHOLD': -0.20
 }
 
-@st.cache_data(ttl=60)
-def get_market_data(symbol):
-    """Get market data for a stock symbol using Yahoo Finance"""
-    try:
-        stock = yf.Ticker(symbol)
-        data = stock.history(period='1d')
+# SQLite trade journal; events are group-committed every JOURNAL_FLUSH_SECONDS
+JOURNAL_PATH = os.environ.get('STRM_JOURNAL', 'data/trades.db')
+JOURNAL_FLUSH_SECONDS = 0.5
+# Ledger snapshot cadence, in journal events per account
+JOURNAL_SNAPSHOT_EVERY = 1000
+
+# Auto-refresh interval of the Trade History panel
+HISTORY_REFRESH_SECONDS = 60
+
+# Closed trades shown per Trade History page
+HISTORY_PAGE_SIZE = 50
+
+# Local append-only store for historical bars
+BAR_STORE_DIR = os.environ.get('STRM_BAR_STORE', 'data/bars')
+
+# Backtest execution costs, in basis points of notional / price
+BACKTEST_FEE_BPS = 3.0
+BACKTEST_SLIPPAGE_BPS = 5.0
+
+# Seconds between auto-trading scans
+AUTO_TRADE_INTERVAL = 30
+
+# Upper bound on concurrent upstream requests during a scan
+MAX_FETCH_WORKERS = 8
+
+# Seconds a cached quote is served before the next lookup refetches it
+QUOTE_CACHE_TTL = 60
+
+# Upstream budget shared by every session: sustained quote fetches per second (0 disables
+# upstream fetches, so only cached quotes are served) and burst size
+UPSTREAM_RATE = float(os.environ.get('STRM_UPSTREAM_RATE', 5))
+UPSTREAM_BURST = 20
+# Longest a caller waits on a queued or in-flight upstream fetch before giving up on it
+UPSTREAM_WAIT_SECONDS = 30
+# Backoff after an upstream failure: first delay and cap in seconds, jittered by +/-50%
+UPSTREAM_BACKOFF_BASE = 2.0
+UPSTREAM_BACKOFF_MAX = 300.0
+# Seconds a symbol keeps open-position priority after a session last asked for its price
+POSITION_PRIORITY_TTL = 120
+
+# How often the background quote engine re-polls the watchlist
+QUOTE_REFRESH_SECONDS = 15
+# Watched symbols no session has asked for in this many seconds stop being polled
+WATCHLIST_TTL = 120
+
+# Company metadata changes rarely, so it lives far longer than the 60s price cache
+METADATA_TTL_DAYS = 7
+# Seconds a failed metadata lookup is remembered before upstream is asked again
+METADATA_FAILURE_TTL = 300
+# Optional JSON file so metadata survives server restarts, rewritten at most every METADATA_SAVE_SECONDS
+METADATA_CACHE_PATH = os.environ.get('STRM_METADATA_CACHE')
+METADATA_SAVE_SECONDS = 5
+
+# 'yahoo' for live data, 'replay' to read recorded bars from REPLAY_DATA_DIR,
+# or 'synthetic' for generated bars (benchmarks and load tests)
+MARKET_DATA_PROVIDER = os.environ.get('STRM_PROVIDER', 'yahoo')
+REPLAY_DATA_DIR = os.environ.get('STRM_REPLAY_DIR', 'data/replay')
+# Bars per synthetic symbol, and simulated upstream latency per synthetic history call
+SYNTHETIC_BARS = 260
+SYNTHETIC_LATENCY = float(os.environ.get('STRM_SYNTHETIC_LATENCY_MS', 0)) / 1000
+
+# Recent samples kept per instrumented stage for the p50/p95/p99 timings
+METRICS_WINDOW = 2048
+# Optional Prometheus text-format file (e.g. for node_exporter's textfile collector)
+METRICS_PATH = os.environ.get('STRM_METRICS_FILE')
+METRICS_EXPORT_SECONDS = float(os.environ.get('STRM_METRICS_EXPORT_SECONDS', 15))
+
+# Symbol universes live in UNIVERSE_DIR as <name>.txt (one symbol per line) or <name>.csv
+UNIVERSE_DIR = os.environ.get('STRM_UNIVERSE_DIR', 'universes')
+DEFAULT_UNIVERSE = 'default'
+# Changed to Indian stocks (NSE symbols with .NS suffix for Yahoo Finance)
+DEFAULT_SYMBOLS = ('RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS', 'INFY.NS',
+                   'HINDUNILVR.NS', 'ICICIBANK.NS', 'ITC.NS',
+                   'KOTAKBANK.NS', 'BHARTIARTL.NS', 'LT.NS')
+# Symbols per fetch shard, so large universes publish results as they arrive
+SCAN_CHUNK_SIZE = 50
+
+# Recorded L2 depth snapshots (JSON lines) that replace the simulated imbalance
+ORDER_BOOK_PATH = os.environ.get('STRM_ORDER_BOOK')
+# Replay pace as a multiple of the recorded timestamps; 0 applies snapshots immediately
+ORDER_BOOK_REPLAY_SPEED = float(os.environ.get('STRM_ORDER_BOOK_SPEED', 1))
+# Price levels per side that count towards the depth-weighted imbalance
+ORDER_BOOK_DEPTH = 5
+
+# Intraday bar interval ('1m' or '5m') feeding the rolling features; empty disables them
+INTRADAY_INTERVAL = os.environ.get('STRM_INTRADAY_INTERVAL', '5m')
+# Bars per rolling feature window (75 five-minute bars is one NSE session)
+INTRADAY_WINDOW = 75
+
+# Rolling intraday features carried on each quote
+FEATURE_COLUMNS = ['vwap', 'volatility_pct', 'range_pct', 'volume_z']
+QUOTE_COLUMNS = ['symbol', 'imbalance', 'spread_pct', 'bid_volume', 'ask_volume',
+                 'liquidity', 'last_price', 'company'] + FEATURE_COLUMNS
+
+class StageMetrics:
+    """Wall-time samples per named stage, with percentiles and Prometheus export"""
+    
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage, seconds):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._totals[stage] = [0, 0.0]
+            samples.append(seconds)
+            self._totals[stage][0] += 1
+            self._totals[stage][1] += seconds
+    
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+    
+    def wrap(self, stage, fn):
+        """Return ``fn`` timed under ``stage``"""
+        @wraps(fn)
+        def timed_fn(*args, **kwargs):
+            with self.timer(stage):
+                return fn(*args, **kwargs)
+        return timed_fn
+    
+    def summary(self):
+        """Per-stage count, total and p50/p95/p99 (seconds) over the recent window"""
+        with self._lock:
+            stages = {stage: (np.fromiter(samples, dtype=float), *self._totals[stage])
+                      for stage, samples in self._samples.items()}
+        return {
+            stage: {
+                'count': count,
+                'total': total,
+                **dict(zip(['p50', 'p95', 'p99'], np.percentile(samples, [50, 95, 99])))
+            }
+            for stage, (samples, count, total) in sorted(stages.items())
+        }
+    
+    def prometheus(self, gauges=None):
+        """Prometheus text exposition of the stage timings plus extra gauges"""
+        lines = ['# HELP strm_stage_seconds Wall time spent per instrumented stage',
+                 '# TYPE strm_stage_seconds summary']
+        for stage, stats in self.summary().items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f'strm_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f'strm_stage_seconds_sum{{stage="{stage}"}} {stats["total"]:.6f}')
+            lines.append(f'strm_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE strm_{name} gauge', f'strm_{name} {value}']
+        return '\n'.join(lines) + '\n'
+    
+    def export(self, path, gauges=None):
+        """Atomically write the Prometheus text to ``path``"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus(gauges))
+        os.replace(tmp_path, path)
+
+@st.cache_resource
+def get_metrics():
+    """Process-wide stage timings"""
+    return StageMetrics()
+
+def timed(stage):
+    """Decorator timing a script-thread function under ``stage`` in the shared metrics"""
+    def decorator(fn):
+        @wraps(fn)
+        def timed_fn(*args, **kwargs):
+            with get_metrics().timer(stage):
+                return fn(*args, **kwargs)
+        return timed_fn
+    return decorator
+
+def _period_offset(period):
+    """Translate a Yahoo-style period ('5d', '1mo', '2y') into a DateOffset"""
+    for suffix, unit in (('mo', 'months'), ('d', 'days'), ('y', 'years')):
+        if period.endswith(suffix):
+            return pd.DateOffset(**{unit: int(period[:-len(suffix)])})
+    raise ValueError(f"Unsupported period: {period}")
+
+class MarketDataProvider:
+    """Source of OHLCV bars and company metadata for the trading pipeline"""
+    
+    # Live L2 books (an OrderBookFeed), when a depth source is configured
+    order_books = None
+    # Rolling intraday bar features (an IntradayFeatures), when enabled
+    intraday = None
+    
+    def get_history(self, symbol, period='1d', interval='1d', start=None):
+        """Return an OHLCV frame (Open/High/Low/Close/Volume) indexed by time
+
+        When ``start`` is given, bars from ``start`` onwards are returned and
+        ``period`` is ignored.
+        """
+        raise NotImplementedError
+    
+    def get_metadata(self, symbol):
+        """Return a dict with company, sector and lot_size"""
+        raise NotImplementedError
+    
+    def get_imbalance(self, symbol, bars):
+        """Return the order book imbalance for the latest bar"""
+        # Simulate order book data (since Yahoo Finance doesn't provide real order book)
+        return np.random.uniform(-0.3, 0.3)
+    
+    def get_quote(self, symbol):
+        """Build a quote from the latest daily bar, or None when there is no data
+
+        Imbalance, volumes and spread come from the L2 book in ``order_books``
+        when it has depth for the symbol. With ``intraday`` set, the quote also
+        carries the rolling intraday features and, without a book, the spread
+        proxy is the latest intraday bar's range rather than the daily one.
+        """
+        data = self.get_history(symbol, period='1d')
         
         if data.empty:
             return None
             
         last_price = data['Close'].iloc[-1]
         spread_pct = (data['High'].iloc[-1] - data['Low'].iloc[-1]) / last_price
-        
-        # Simulate order book data (since Yahoo Finance doesn't provide real order book)
-        imbalance = np.random.uniform(-0.3, 0.3)
-        total_bid = (1 + imbalance) * 1000  # Simulated volume
-        total_ask = (1 - imbalance) * 1000  # Simulated volume
+        features = self.intraday.update(symbol, self) if self.intraday is not None else None
+        if features is not None:
+            spread_pct = features.pop('bar_range_pct') / 100
+        depth = self.order_books.depth(symbol) if self.order_books is not None else None
+        if depth is not None:
+            imbalance = depth['imbalance']
+            spread_pct = depth['spread_pct'] / 100
+            total_bid, total_ask = depth['bid_volume'], depth['ask_volume']
+        else:
+            imbalance = self.get_imbalance(symbol, data)
+            total_bid = (1 + imbalance) * 1000  # Simulated volume
+            total_ask = (1 - imbalance) * 1000  # Simulated volume
         
         return {
             'symbol': symbol,
@@ -50,93 +276,2439 @@ def get_market_data(symbol):
             'ask_volume': total_ask,
             'liquidity': (total_bid + total_ask) * last_price,
             'last_price': last_price,
-            'company': stock.info.get('longName', symbol)
+            **(features or {})
+        }
+
+class YahooProvider(MarketDataProvider):
+    """Live data from Yahoo Finance"""
+    
+    def get_history(self, symbol, period='1d', interval='1d', start=None):
+        if start is not None:
+            return yf.Ticker(symbol).history(start=start, interval=interval)
+        return yf.Ticker(symbol).history(period=period, interval=interval)
+    
+    def get_metadata(self, symbol):
+        info = yf.Ticker(symbol).info
+        return {
+            'company': info.get('longName', symbol),
+            'sector': info.get('sector'),
+            'lot_size': 1  # NSE cash-segment equities trade in lots of one share
         }
+
+class ReplayProvider(MarketDataProvider):
+    """Deterministic offline data replayed from recorded files.
+
+    ``root`` holds one ``<SYMBOL>.parquet`` or ``<SYMBOL>.csv`` per symbol with a
+    timestamp first column and Open/High/Low/Close/Volume columns, plus an
+    optional ``imbalance`` column. An optional ``metadata.csv`` maps ``symbol``
+    to ``company``, ``sector`` and ``lot_size``.
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._metadata = {}
+        metadata_path = os.path.join(root, 'metadata.csv')
+        if os.path.exists(metadata_path):
+            metadata = pd.read_csv(metadata_path)
+            self._metadata = metadata.set_index('symbol').to_dict('index')
+    
+    def _load(self, symbol):
+        with self._lock:
+            if symbol in self._frames:
+                return self._frames[symbol]
+        
+        parquet_path = os.path.join(self.root, f"{symbol}.parquet")
+        csv_path = os.path.join(self.root, f"{symbol}.csv")
+        if os.path.exists(parquet_path):
+            frame = pd.read_parquet(parquet_path)
+        elif os.path.exists(csv_path):
+            frame = pd.read_csv(csv_path, index_col=0)
+        else:
+            frame = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        frame.index = pd.to_datetime(frame.index)
+        frame = frame.sort_index()
+        
+        with self._lock:
+            self._frames[symbol] = frame
+        return frame
+    
+    def get_history(self, symbol, period='1d', interval='1d', start=None):
+        frame = self._load(symbol)
+        if frame.empty:
+            return frame
+        if start is not None:
+            start = pd.Timestamp(start)
+            if frame.index.tz is not None and start.tz is None:
+                start = start.tz_localize('UTC')
+            elif frame.index.tz is None and start.tz is not None:
+                start = start.tz_convert('UTC').tz_localize(None)
+            return frame[frame.index >= start]
+        if period == 'max':
+            return frame
+        # Periods are measured back from the last recorded bar, not the wall clock
+        last_day = frame.index[-1].normalize()
+        if period == 'ytd':
+            start = last_day.replace(month=1, day=1)
+        else:
+            start = last_day - _period_offset(period) + pd.Timedelta(days=1)
+        return frame[frame.index >= start]
+    
+    def get_metadata(self, symbol):
+        row = self._metadata.get(symbol, {})
+        return {
+            'company': row.get('company', symbol),
+            'sector': row.get('sector'),
+            'lot_size': int(row.get('lot_size', 1))
+        }
+    
+    def get_imbalance(self, symbol, bars):
+        if 'imbalance' in bars.columns:
+            return float(bars['imbalance'].iloc[-1])
+        # Seed from symbol and bar time so repeated runs see identical signals
+        seed = zlib.crc32(f"{symbol}|{bars.index[-1].isoformat()}".encode())
+        return np.random.default_rng(seed).uniform(-0.3, 0.3)
+
+class SyntheticProvider(ReplayProvider):
+    """Generated bars for any symbol, with no network or files.
+
+    Each symbol gets a seeded random walk, so runs are repeatable, and every
+    history call sleeps ``latency`` seconds to stand in for an upstream round
+    trip. ``history_calls`` and ``metadata_calls`` count upstream requests.
+    """
+    
+    def __init__(self, bars=SYNTHETIC_BARS, latency=SYNTHETIC_LATENCY):
+        self.root = None
+        self.bars = bars
+        self.latency = latency
+        self.history_calls = 0
+        self.metadata_calls = 0
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._metadata = {}
+    
+    def _load(self, symbol):
+        with self._lock:
+            if symbol in self._frames:
+                return self._frames[symbol]
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, self.bars)))
+        open_ = close * np.exp(rng.normal(0, 0.005, self.bars))
+        # Independent upper and lower wicks put the close anywhere in the bar's
+        # range, so bar_imbalance varies the way it does on real bars
+        wicks = close[:, None] * rng.uniform(0, 0.01, (self.bars, 2))
+        frame = pd.DataFrame({
+            'Open': open_,
+            'High': np.maximum(open_, close) + wicks[:, 0],
+            'Low': np.minimum(open_, close) - wicks[:, 1],
+            'Close': close,
+            'Volume': rng.integers(10_000, 1_000_000, self.bars).astype(float)
+        }, index=pd.bdate_range(end='2024-06-28', periods=self.bars))
+        with self._lock:
+            self._frames[symbol] = frame
+        return frame
+    
+    def get_history(self, symbol, period='1d', interval='1d', start=None):
+        with self._lock:
+            self.history_calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return super().get_history(symbol, period=period, interval=interval, start=start)
+    
+    def get_metadata(self, symbol):
+        with self._lock:
+            self.metadata_calls += 1
+        return {'company': f"{symbol.split('.')[0]} Synthetic Ltd", 'sector': 'Synthetic', 'lot_size': 1}
+
+class BookSide:
+    """One side of an L2 book, with price levels kept sorted best-first.
+
+    Levels are located with bisect in O(log n) comparisons. A size change at
+    an existing level stops there; adding or removing a level shifts the
+    list behind it, which is O(n) but a memmove of at most a few hundred
+    pointers for realistic book depths. The plain and depth-weighted size of the top ``depth`` levels are kept as
+    running totals: a size change inside the top levels adjusts them in O(1),
+    an insert or delete there re-tallies just those ``depth`` levels, and
+    updates deeper in the book leave them untouched.
+    """
+    
+    def __init__(self, descending, depth=ORDER_BOOK_DEPTH):
+        # Keys are sign * price so that ascending key order is best-first on both sides
+        self._sign = -1.0 if descending else 1.0
+        self._keys = []
+        self._sizes = {}
+        self.depth = depth
+        # Linearly decaying weights: the touch counts fully, level N barely
+        self._weights = [1 - level / depth for level in range(depth)]
+        self.volume = 0.0
+        self.weighted = 0.0
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def best(self):
+        return self._sign * self._keys[0] if self._keys else np.nan
+    
+    def levels(self):
+        """(price, size) pairs best-first"""
+        return [(self._sign * key, self._sizes[key]) for key in self._keys]
+    
+    def update(self, price, size):
+        """Set the resting size at ``price``; a size of zero removes the level"""
+        key = self._sign * float(price)
+        size = float(size)
+        index = bisect.bisect_left(self._keys, key)
+        exists = index < len(self._keys) and self._keys[index] == key
+        if size <= 0:
+            if not exists:
+                return
+            del self._keys[index]
+            del self._sizes[key]
+        elif exists:
+            change = size - self._sizes[key]
+            self._sizes[key] = size
+            if index < self.depth:
+                self.volume += change
+                self.weighted += self._weights[index] * change
+            return
+        else:
+            self._keys.insert(index, key)
+            self._sizes[key] = size
+        if index < self.depth:
+            self._retally()
+    
+    def replace(self, levels):
+        """Apply a full depth snapshot as updates to the levels that changed"""
+        incoming = {self._sign * float(price): float(size) for price, size in levels}
+        for key in [key for key in self._keys if key not in incoming]:
+            self.update(self._sign * key, 0)
+        for key, size in incoming.items():
+            if self._sizes.get(key) != size:
+                self.update(self._sign * key, size)
+    
+    def _retally(self):
+        top = [self._sizes[key] for key in self._keys[:self.depth]]
+        self.volume = sum(top)
+        self.weighted = sum(weight * size for weight, size in zip(self._weights, top))
+
+class OrderBook:
+    """L2 book for one symbol"""
+    
+    def __init__(self, depth=ORDER_BOOK_DEPTH):
+        self.bids = BookSide(descending=True, depth=depth)
+        self.asks = BookSide(descending=False, depth=depth)
+        self.updated_at = None
+    
+    def update(self, side, price, size):
+        (self.bids if side == 'bid' else self.asks).update(price, size)
+    
+    def apply_snapshot(self, bids, asks, timestamp=None):
+        self.bids.replace(bids)
+        self.asks.replace(asks)
+        self.updated_at = timestamp
+    
+    def imbalance(self):
+        """Depth-weighted (bid - ask) / (bid + ask) over the top levels, in [-1, 1]"""
+        total = self.bids.weighted + self.asks.weighted
+        return (self.bids.weighted - self.asks.weighted) / total if total > 0 else np.nan
+    
+    def spread_pct(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        return (ask - bid) / ((ask + bid) / 2) * 100
+
+class DepthSource:
+    """Pluggable stream of L2 depth snapshots"""
+    
+    def snapshots(self):
+        """Yield (symbol, bids, asks, timestamp) with bids/asks as (price, size) pairs"""
+        raise NotImplementedError
+
+class RecordedDepthSource(DepthSource):
+    """Depth snapshots replayed from a JSON-lines recording.
+
+    Each line is ``{"time": ..., "symbol": ..., "bids": [[price, size], ...],
+    "asks": [[price, size], ...]}`` in time order. ``speed`` replays at that
+    multiple of the recorded pace; 0 replays as fast as possible.
+    """
+    
+    def __init__(self, path, speed=ORDER_BOOK_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+    
+    def snapshots(self):
+        previous = None
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                timestamp = pd.Timestamp(record['time'])
+                if self.speed > 0 and previous is not None:
+                    time.sleep(max(0.0, (timestamp - previous).total_seconds()) / self.speed)
+                previous = timestamp
+                yield record['symbol'], record['bids'], record['asks'], timestamp
+
+class OrderBookFeed:
+    """Per-symbol L2 books kept current from a DepthSource on a background thread"""
+    
+    def __init__(self, source, depth=ORDER_BOOK_DEPTH):
+        self.source = source
+        self.depth_levels = depth
+        self.books = {}
+        self.updates = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def apply(self, symbol, bids, asks, timestamp=None):
+        with self._lock:
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = OrderBook(self.depth_levels)
+            book.apply_snapshot(bids, asks, timestamp)
+            self.updates += 1
+    
+    def depth(self, symbol):
+        """Quote fields from the symbol's book, or None when either side is empty"""
+        with self._lock:
+            book = self.books.get(symbol)
+            if book is None or not len(book.bids) or not len(book.asks):
+                return None
+            return {
+                'imbalance': book.imbalance(),
+                'spread_pct': book.spread_pct(),
+                'bid_volume': book.bids.volume,
+                'ask_volume': book.asks.volume
+            }
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        try:
+            for symbol, bids, asks, timestamp in self.source.snapshots():
+                self.apply(symbol, bids, asks, timestamp)
+        except Exception as e:
+            self.last_error = str(e)
+
+class RollingBars:
+    """Fixed-size ring buffer of intraday bars with O(1) rolling features.
+
+    VWAP, realized volatility and volume mean/variance come from running sums
+    that are adjusted as a bar enters and the oldest leaves; the window high
+    and low come from monotonic deques, amortized O(1) per bar. The sums are
+    rebuilt from the buffer once per wrap so float drift cannot accumulate.
+    The newest bar can be overwritten in place while it is still forming.
+    """
+    
+    def __init__(self, window=INTRADAY_WINDOW):
+        self.window = window
+        self._typical = np.zeros(window)
+        self._volume = np.zeros(window)
+        self._returns = np.zeros(window)
+        self._high = np.zeros(window)
+        self._low = np.zeros(window)
+        self._count = 0
+        self.last_time = None
+        self.last_close = np.nan
+        self._prev_close = np.nan  # close before the newest bar, for its return
+        self.last_range_pct = np.nan
+        self._highs = deque()
+        self._lows = deque()
+        self._sum_pv = self._sum_v = self._sum_v2 = self._sum_r2 = 0.0
+    
+    def __len__(self):
+        return min(self._count, self.window)
+    
+    def push(self, timestamp, high, low, close, volume):
+        slot = self._count % self.window
+        if self._count >= self.window:
+            self._sum_pv -= self._typical[slot] * self._volume[slot]
+            self._sum_v -= self._volume[slot]
+            self._sum_v2 -= self._volume[slot] ** 2
+            self._sum_r2 -= self._returns[slot] ** 2
+        
+        self._prev_close = self.last_close
+        self._store(slot, high, low, close, volume)
+        self._track(self._count, high, low)
+        oldest = self._count - self.window + 1
+        while self._highs[0][0] < oldest:
+            self._highs.popleft()
+        while self._lows[0][0] < oldest:
+            self._lows.popleft()
+        
+        self._count += 1
+        self.last_time = timestamp
+        self.last_close = close
+        self.last_range_pct = (high - low) / close * 100 if close > 0 else np.nan
+        if self._count % self.window == 0:
+            self._resum()
+    
+    def replace_last(self, timestamp, high, low, close, volume):
+        """Overwrite the newest bar, e.g. with a refetch of a bar that was still forming"""
+        number = self._count - 1
+        slot = number % self.window
+        widened = high >= self._high[slot] and low <= self._low[slot]
+        self._sum_pv -= self._typical[slot] * self._volume[slot]
+        self._sum_v -= self._volume[slot]
+        self._sum_v2 -= self._volume[slot] ** 2
+        self._sum_r2 -= self._returns[slot] ** 2
+        self._store(slot, high, low, close, volume)
+        
+        if widened:
+            # The newest bar is always last in both deques, and whatever its old
+            # levels evicted the wider ones would have evicted too
+            self._highs.pop()
+            self._lows.pop()
+            self._track(number, high, low)
+        else:
+            self._highs.clear()
+            self._lows.clear()
+            for earlier in range(max(0, self._count - self.window), self._count):
+                self._track(earlier, self._high[earlier % self.window], self._low[earlier % self.window])
+        
+        self.last_time = timestamp
+        self.last_close = close
+        self.last_range_pct = (high - low) / close * 100 if close > 0 else np.nan
+    
+    def _store(self, slot, high, low, close, volume):
+        """Write a bar into ``slot`` and add it to the running sums"""
+        typical = (high + low + close) / 3
+        log_return = np.log(close / self._prev_close) if self._prev_close > 0 else 0.0
+        self._typical[slot], self._volume[slot], self._returns[slot] = typical, volume, log_return
+        self._high[slot], self._low[slot] = high, low
+        self._sum_pv += typical * volume
+        self._sum_v += volume
+        self._sum_v2 += volume ** 2
+        self._sum_r2 += log_return ** 2
+    
+    def _track(self, number, high, low):
+        """Append bar ``number`` to the high/low deques"""
+        # Deques hold (bar number, level) with levels monotonic from the front
+        while self._highs and self._highs[-1][1] <= high:
+            self._highs.pop()
+        self._highs.append((number, high))
+        while self._lows and self._lows[-1][1] >= low:
+            self._lows.pop()
+        self._lows.append((number, low))
+    
+    def _resum(self):
+        size = len(self)
+        typical, volume, returns = self._typical[:size], self._volume[:size], self._returns[:size]
+        self._sum_pv = float(typical @ volume)
+        self._sum_v = float(volume.sum())
+        self._sum_v2 = float(volume @ volume)
+        self._sum_r2 = float(returns @ returns)
+    
+    def features(self):
+        size = len(self)
+        if not size:
+            return None
+        mean_volume = self._sum_v / size
+        std_volume = np.sqrt(max(self._sum_v2 / size - mean_volume ** 2, 0.0))
+        last_volume = self._volume[(self._count - 1) % self.window]
+        return {
+            'vwap': self._sum_pv / self._sum_v if self._sum_v > 0 else np.nan,
+            'volatility_pct': np.sqrt(max(self._sum_r2, 0.0)) * 100,
+            'range_pct': (self._highs[0][1] - self._lows[0][1]) / self.last_close * 100,
+            'volume_z': (last_volume - mean_volume) / std_volume if std_volume > 0 else 0.0,
+            'bar_range_pct': self.last_range_pct
+        }
+
+class IntradayFeatures:
+    """Per-symbol RollingBars fed by tail-syncing intraday bars from a provider"""
+    
+    def __init__(self, interval=INTRADAY_INTERVAL, window=INTRADAY_WINDOW):
+        self.interval = interval
+        self.window = window
+        self._buffers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+    
+    def ingest(self, symbol, bars):
+        """Push the bars newer than the symbol's last ingested bar, replacing that bar if it was refetched"""
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is None:
+                buffer = self._buffers[symbol] = RollingBars(self.window)
+                self._locks[symbol] = threading.Lock()
+            lock = self._locks[symbol]
+        with lock:
+            if buffer.last_time is not None:
+                # The tail fetch starts at the last ingested bar, which may have
+                # been still forming then and has grown since
+                bars = bars[bars.index >= buffer.last_time]
+                if len(bars) and bars.index[0] == buffer.last_time:
+                    buffer.replace_last(*next(self._rows(bars.iloc[:1])))
+                    bars = bars.iloc[1:]
+            # Only the last window of bars can affect the features
+            for row in self._rows(bars.iloc[-self.window:]):
+                buffer.push(*row)
+            return buffer.features()
+    
+    @staticmethod
+    def _rows(bars):
+        return zip(bars.index, bars['High'].to_numpy(dtype=float), bars['Low'].to_numpy(dtype=float),
+                   bars['Close'].to_numpy(dtype=float), bars['Volume'].to_numpy(dtype=float))
+    
+    def update(self, symbol, provider):
+        """Fetch the symbol's new intraday bars and return its current features"""
+        buffer = self._buffers.get(symbol)
+        if buffer is None or buffer.last_time is None:
+            bars = provider.get_history(symbol, period='5d', interval=self.interval)
+        else:
+            bars = provider.get_history(symbol, interval=self.interval, start=buffer.last_time)
+        return self.ingest(symbol, bars.dropna(subset=['Close']))
+
+@st.cache_resource
+def get_intraday_features():
+    """Process-wide intraday feature buffers, or None when INTRADAY_INTERVAL is empty"""
+    return IntradayFeatures() if INTRADAY_INTERVAL else None
+
+@st.cache_resource
+def get_order_book_feed():
+    """Process-wide L2 feed from ORDER_BOOK_PATH, or None when no recording is configured"""
+    if not ORDER_BOOK_PATH:
+        return None
+    feed = OrderBookFeed(RecordedDepthSource(ORDER_BOOK_PATH))
+    feed.start()
+    return feed
+
+@st.cache_resource
+def get_provider():
+    """Process-wide market data provider selected by STRM_PROVIDER"""
+    if MARKET_DATA_PROVIDER == 'replay':
+        provider = ReplayProvider(REPLAY_DATA_DIR)
+    elif MARKET_DATA_PROVIDER == 'synthetic':
+        provider = SyntheticProvider()
+    else:
+        provider = YahooProvider()
+    provider.order_books = get_order_book_feed()
+    provider.intraday = get_intraday_features()
+    return provider
+
+def _normalize_symbol(symbol):
+    """Upper-case a symbol and default bare NSE tickers to Yahoo's .NS suffix"""
+    symbol = str(symbol).strip().upper()
+    return symbol if '.' in symbol else f"{symbol}.NS"
+
+def _read_universe_file(path):
+    if path.endswith('.csv'):
+        # Index constituent files as published by NSE carry a 'Symbol' column
+        frame = pd.read_csv(path)
+        column = next(c for c in frame.columns if c.strip().lower() == 'symbol')
+        symbols = frame[column].dropna().tolist()
+    else:
+        with open(path) as f:
+            symbols = [line.split('#')[0] for line in f]
+    return [_normalize_symbol(s) for s in symbols if str(s).strip()]
+
+@st.cache_data(ttl=3600)
+def list_universes():
+    """Names of the symbol universes available in UNIVERSE_DIR"""
+    if not os.path.isdir(UNIVERSE_DIR):
+        return [DEFAULT_UNIVERSE]
+    names = sorted({
+        os.path.splitext(name)[0] for name in os.listdir(UNIVERSE_DIR)
+        if name.endswith(('.txt', '.csv'))
+    })
+    return names or [DEFAULT_UNIVERSE]
+
+@st.cache_data(ttl=3600)
+def load_universe(name=DEFAULT_UNIVERSE):
+    """Load a universe's symbols from ``<name>.csv`` or ``<name>.txt``, de-duplicated in file order"""
+    for extension in ('.csv', '.txt'):
+        path = os.path.join(UNIVERSE_DIR, f"{name}{extension}")
+        if os.path.exists(path):
+            return list(dict.fromkeys(_read_universe_file(path)))
+    if name == DEFAULT_UNIVERSE:
+        return list(DEFAULT_SYMBOLS)
+    raise FileNotFoundError(f"No universe file for '{name}' in {UNIVERSE_DIR}")
+
+def shard_symbols(symbols, size):
+    """Split a symbol list into consecutive shards of at most ``size`` symbols"""
+    symbols = list(symbols)
+    return [symbols[i:i + size] for i in range(0, len(symbols), size)]
+
+def fetch_metadata(symbol):
+    """Fetch company metadata for a stock symbol from the active provider (uncached)"""
+    return get_provider().get_metadata(symbol)
+
+class MetadataStore:
+    """Thread-safe, long-TTL store for company name, sector and lot size.
+
+    Failed lookups are cached too, for ``failure_ttl`` seconds, serving the
+    expired entry or a placeholder, so a symbol whose metadata keeps failing
+    does not cost an upstream call on every quote refresh. Writes to ``path``
+    are batched: at most one rewrite every ``save_interval`` seconds, plus a
+    final one at exit.
+    """
+    
+    def __init__(self, ttl_days=METADATA_TTL_DAYS, path=None, fetch=fetch_metadata,
+                 failure_ttl=METADATA_FAILURE_TTL, save_interval=METADATA_SAVE_SECONDS):
+        self.ttl = ttl_days * 86400
+        self.failure_ttl = failure_ttl
+        self.path = path
+        self.fetch = fetch
+        self.save_interval = save_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        if path:
+            atexit.register(self.flush)
+    
+    def get(self, symbol):
+        """Return metadata for a symbol, fetching it only when missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            ttl = self.failure_ttl if entry and entry.get('failed') else self.ttl
+            if entry and now - entry['fetched_at'] < ttl:
+                self.hits += 1
+                return entry['data']
+            self.misses += 1
+        
+        try:
+            data = self.fetch(symbol)
+            failed = False
+        except Exception:
+            # Keep serving an expired entry rather than dropping the company name
+            data = entry['data'] if entry else {'company': symbol, 'sector': None, 'lot_size': 1}
+            failed = True
+        
+        with self._lock:
+            self._entries[symbol] = {'fetched_at': time.time(), 'data': data, 'failed': failed}
+            self._dirty = True
+        self._save()
+        return data
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+    
+    def flush(self):
+        """Write pending entries to ``path`` now"""
+        self._save(force=True)
+    
+    def _save(self, force=False):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._saved_at < self.save_interval):
+                return
+            payload = json.dumps(self._entries)
+            self._dirty = False
+            self._saved_at = time.time()
+        # Serialized under the entry lock, written outside it
+        with self._save_lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+
+@st.cache_resource
+def get_metadata_store():
+    """Process-wide metadata store shared by all sessions"""
+    return MetadataStore(path=METADATA_CACHE_PATH,
+                         fetch=get_metrics().wrap('upstream_metadata', get_provider().get_metadata))
+
+def fetch_quote(symbol, provider=None, metadata_store=None):
+    """Fetch a quote for a stock symbol (uncached, raises on failure)
+
+    Uses the active provider and the shared metadata store by default; an
+    explicitly passed provider supplies its own metadata unless a
+    ``metadata_store`` is given too.
+    """
+    if provider is None:
+        provider = get_provider()
+        metadata_store = metadata_store or get_metadata_store()
+    quote = provider.get_quote(symbol)
+    if quote:
+        metadata = metadata_store.get(symbol) if metadata_store else provider.get_metadata(symbol)
+        quote['company'] = metadata['company']
+    return quote
+
+class UpstreamBackoff(Exception):
+    """Raised instead of calling upstream while a symbol, or the provider, is backing off"""
+
+# yfinance's own throttling error; releases before it surface the HTTP error instead
+_YF_RATE_LIMIT_ERROR = getattr(getattr(yf, 'exceptions', None), 'YFRateLimitError', ())
+
+def _is_rate_limited(error):
+    """Whether an upstream error is a throttling response (YFRateLimitError or an HTTP 429)"""
+    if isinstance(error, _YF_RATE_LIMIT_ERROR):
+        return True
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+class FetchScheduler:
+    """Central gate for upstream quote fetches, shared by every session.
+
+    Requests wait in a priority queue, symbols held in open positions ahead of
+    the watchlist, and are dispatched only as fast as a token bucket allows.
+    Upstream call volume therefore stays within ``burst`` plus ``rate`` per
+    second however many sessions are connected. A failing symbol backs off
+    exponentially with jitter, and a rate-limit response pauses all dispatch
+    the same way, failing whatever is still queued. Requests made during a
+    backoff, or with a zero rate, fail fast with UpstreamBackoff instead of
+    reaching upstream, as do fetches still waiting after ``wait`` seconds.
+    """
+    
+    POSITION, WATCHLIST = 0, 1
+    
+    def __init__(self, upstream, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_workers=MAX_FETCH_WORKERS,
+                 backoff_base=UPSTREAM_BACKOFF_BASE, backoff_max=UPSTREAM_BACKOFF_MAX,
+                 priority_ttl=POSITION_PRIORITY_TTL, wait=UPSTREAM_WAIT_SECONDS):
+        self.upstream = upstream
+        self.rate = rate
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.priority_ttl = priority_ttl
+        self.wait = wait
+        self.dispatched = 0
+        self.rejected = 0
+        self.failures = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._queue = []  # (priority, sequence, symbol, future)
+        self._sequence = itertools.count()
+        self._held = {}  # symbol -> monotonic deadline of position priority
+        self._backoff = {}  # symbol -> (consecutive failures, retry at)
+        self._throttle = (0, 0.0)  # consecutive rate-limit responses, dispatch paused until
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upstream')
+        self._thread = None
+    
+    def prioritize(self, symbols):
+        """Mark symbols as held in open positions, so their fetches jump the queue"""
+        deadline = time.monotonic() + self.priority_ttl
+        with self._cond:
+            for symbol in symbols:
+                self._held[symbol] = deadline
+    
+    def submit(self, symbol):
+        """Queue an upstream fetch for ``symbol``; returns a Future of its result"""
+        future = Future()
+        now = time.monotonic()
+        with self._cond:
+            if self.rate <= 0:
+                self.rejected += 1
+                future.set_exception(UpstreamBackoff("upstream fetches are disabled (rate 0)"))
+                return future
+            retry_at = max(self._backoff.get(symbol, (0, 0.0))[1], self._throttle[1])
+            if retry_at > now:
+                self.rejected += 1
+                future.set_exception(UpstreamBackoff(f"upstream backing off for {retry_at - now:.1f}s"))
+                return future
+            held_until = self._held.get(symbol)
+            if held_until is not None and held_until <= now:
+                del self._held[symbol]
+                held_until = None
+            priority = self.POSITION if held_until is not None else self.WATCHLIST
+            heapq.heappush(self._queue, (priority, next(self._sequence), symbol, future))
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fetch-scheduler', daemon=True)
+                self._thread.start()
+        return future
+    
+    def fetch(self, symbol):
+        """Blocking fetch through the scheduler, giving up after ``wait`` seconds"""
+        future = self.submit(symbol)
+        try:
+            return future.result(timeout=self.wait)
+        except TimeoutError:
+            # Still queued fetches are dropped; one already dispatched just finishes unread
+            future.cancel()
+            raise UpstreamBackoff(f"upstream fetch for {symbol} timed out after {self.wait}s") from None
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                    self._refilled = now
+                    if not self._queue:
+                        timeout = None
+                    elif self._throttle[1] > now:
+                        timeout = self._throttle[1] - now
+                    elif self._tokens < 1:
+                        timeout = (1 - self._tokens) / self.rate if self.rate > 0 else None
+                    else:
+                        break
+                    self._cond.wait(timeout)
+                _, _, symbol, future = heapq.heappop(self._queue)
+                if not future.set_running_or_notify_cancel():
+                    continue  # Caller gave up waiting; spend no token on it
+                self._tokens -= 1
+                self.dispatched += 1
+            self._pool.submit(self._call, symbol, future)
+    
+    def _call(self, symbol, future):
+        try:
+            value = self.upstream(symbol)
+        except Exception as e:
+            now = time.monotonic()
+            paused = []
+            with self._cond:
+                self.failures += 1
+                failures = self._backoff.get(symbol, (0, 0.0))[0] + 1
+                self._backoff[symbol] = (failures, now + self._delay(failures))
+                if _is_rate_limited(e):
+                    throttles = self._throttle[0] + 1
+                    self._throttle = (throttles, now + self._delay(throttles))
+                    # Fail everything queued behind the pause so callers fall back to stale quotes now
+                    paused, self._queue = self._queue, []
+                    self.rejected += len(paused)
+            future.set_exception(e)
+            for _, _, _, waiting in paused:
+                if waiting.set_running_or_notify_cancel():
+                    waiting.set_exception(UpstreamBackoff(f"upstream rate limited for {self._throttle[1] - now:.1f}s"))
+            return
+        with self._cond:
+            self._backoff.pop(symbol, None)
+            self._throttle = (0, self._throttle[1])
+        future.set_result(value)
+    
+    def _delay(self, failures):
+        """Jittered exponential backoff, so recovering clients do not retry in lockstep"""
+        return min(self.backoff_max, self.backoff_base * 2 ** (failures - 1)) * np.random.uniform(0.5, 1.5)
+    
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'queued': sum(1 for *_, future in self._queue if not future.cancelled()),
+                'dispatched': self.dispatched,
+                'rejected': self.rejected,
+                'failures': self.failures,
+                'backing_off': sum(1 for _, retry_at in self._backoff.values() if retry_at > now),
+                'throttled_for': max(0.0, self._throttle[1] - now)
+            }
+
+class QuoteCache:
+    """Process-wide TTL quote cache with single-flight fetches.
+
+    Concurrent misses for the same symbol, from any session or thread, share
+    one in-flight upstream request instead of each firing their own, waiting
+    at most ``wait`` seconds for it. When a refetch fails or times out, the
+    expired quote is served rather than the error.
+    """
+    
+    def __init__(self, fetch=fetch_quote, ttl=QUOTE_CACHE_TTL, wait=UPSTREAM_WAIT_SECONDS):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.wait = wait
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+    
+    def get(self, symbol, force=False):
+        """Return a quote, fetching it on a miss; ``force`` skips fresh entries but still coalesces"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if not force and entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(symbol)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                future = self._inflight[symbol] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return future.result(timeout=self.wait)
+            except TimeoutError:
+                if entry is None:
+                    raise UpstreamBackoff(f"upstream fetch for {symbol} timed out after {self.wait}s") from None
+                with self._lock:
+                    self.stale += 1
+                return entry[1]
+        
+        try:
+            value = self.fetch(symbol)
+        except Exception as e:
+            with self._lock:
+                del self._inflight[symbol]
+                if entry is not None:
+                    self.stale += 1
+            if entry is None:
+                future.set_exception(e)
+                raise
+            # Serve the expired quote while upstream recovers instead of surfacing the error
+            future.set_result(entry[1])
+            return entry[1]
+        with self._lock:
+            self._entries[symbol] = (time.monotonic() + self.ttl, value)
+            del self._inflight[symbol]
+        future.set_result(value)
+        return value
+    
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(symbol, None)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'stale': self.stale,
+                'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+
+@st.cache_resource
+def get_quote_cache():
+    """Process-wide quote cache shared by all sessions"""
+    # Bind the shared provider and metadata store here, on the script thread:
+    # st.cache_resource never returns cached values to threads without a script
+    # context, so worker threads must not look them up themselves.
+    return QuoteCache(fetch=get_fetch_scheduler().fetch)
+
+@st.cache_resource
+def get_fetch_scheduler():
+    """Process-wide upstream fetch scheduler; every cache miss and engine poll goes through it"""
+    fetch = partial(fetch_quote, provider=get_provider(), metadata_store=get_metadata_store())
+    return FetchScheduler(upstream=get_metrics().wrap('upstream_quote', fetch))
+
+def metrics_gauges(quote_cache, metadata_store, provider=None, scheduler=None):
+    """Cache effectiveness and upstream scheduling gauges for the metrics export and debug panel"""
+    quote_stats, metadata_stats = quote_cache.stats(), metadata_store.stats()
+    gauges = {
+        'quote_cache_hit_ratio': quote_stats['hit_ratio'],
+        'quote_cache_entries': quote_stats['entries'],
+        'quote_cache_stale_served': quote_stats['stale'],
+        'metadata_cache_hit_ratio': metadata_stats['hit_ratio'],
+        'metadata_cache_entries': metadata_stats['entries']
+    }
+    if scheduler is not None:
+        gauges.update({f"upstream_{name}": value for name, value in scheduler.stats().items()})
+    # Providers that count their own upstream requests (e.g. SyntheticProvider)
+    for counter in ('history_calls', 'metadata_calls'):
+        if hasattr(provider, counter):
+            gauges[f"upstream_{counter}"] = getattr(provider, counter)
+    return gauges
+
+@st.cache_resource
+def start_metrics_export():
+    """Rewrite METRICS_PATH every METRICS_EXPORT_SECONDS on a background thread"""
+    if not METRICS_PATH:
+        return None
+    metrics, quote_cache, metadata_store = get_metrics(), get_quote_cache(), get_metadata_store()
+    provider, scheduler = get_provider(), get_fetch_scheduler()
+    
+    def export_loop():
+        while True:
+            try:
+                metrics.export(METRICS_PATH, metrics_gauges(quote_cache, metadata_store, provider, scheduler))
+            except OSError:
+                pass
+            time.sleep(METRICS_EXPORT_SECONDS)
+    
+    thread = threading.Thread(target=export_loop, daemon=True)
+    thread.start()
+    return thread
+
+@timed('get_market_data')
+def get_market_data(symbol):
+    """Get market data for a stock symbol from the active provider"""
+    try:
+        return get_quote_cache().get(symbol)
     except Exception as e:
         st.error(f"Error fetching data for {symbol}: {str(e)}")
         return None
 
-def get_trading_opportunities(symbols, buy_threshold, sell_threshold):
-    """Get trading opportunities based on order book imbalance"""
-    opportunities = []
-    for symbol in symbols:
-        data = get_market_data(symbol)
-        if data:
-            side = None
-            if data['imbalance'] >= buy_threshold:
-                side = 'BUY'
-            elif data['imbalance'] <= sell_threshold:
-                side = 'SELL'
-                
-            if side:
-                opportunities.append({
-                    'timestamp': pd.Timestamp.now(),
-                    'symbol': symbol,
-                    'company': data['company'],
-                    'side': side,
-                    'price': data['last_price'],
-                    'imbalance': data['imbalance'],
-                    'volume': data['bid_volume'] if side == 'BUY' else data['ask_volume'],
-                    'spread_pct': data['spread_pct'],
-                    'liquidity': data['liquidity']
+def fetch_quotes(symbols, fetch=None, max_workers=MAX_FETCH_WORKERS):
+    """Fetch quotes for many symbols concurrently (through the shared cache by default).
+
+    Returns a frame with one row per symbol that produced data (in input order)
+    and a dict of symbol -> error message for the ones that failed.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return pd.DataFrame(columns=QUOTE_COLUMNS), {}
+    if fetch is None:
+        fetch = get_quote_cache().get
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(symbols)))) as pool:
+        futures = [(symbol, pool.submit(fetch, symbol)) for symbol in symbols]
+    
+    rows, errors = [], {}
+    for symbol, future in futures:
+        try:
+            quote = future.result()
+        except Exception as e:
+            errors[symbol] = str(e)
+            continue
+        if quote:
+            rows.append(quote)
+    return pd.DataFrame(rows, columns=QUOTE_COLUMNS), errors
+
+class QuoteEngine:
+    """Background worker that keeps an in-memory latest-quote table for a watchlist.
+
+    One engine is shared by every session: it polls the provider on a fixed
+    cadence, so reruns read a snapshot instead of blocking on HTTP. Callers that
+    need fresh data block in ``wait_for_update``. Each published chunk is
+    also run through the stop-loss / take-profit check of every ledger that
+    ``ledgers`` returns, whose held symbols stay on the watchlist, so exits
+    fire with no session or auto trader open.
+    """
+    
+    def __init__(self, fetch=fetch_quote, interval=QUOTE_REFRESH_SECONDS, max_workers=MAX_FETCH_WORKERS,
+                 watch_ttl=WATCHLIST_TTL, ledgers=None):
+        self.fetch = fetch
+        self.ledgers = ledgers or (lambda: [])
+        self.exits = 0
+        self.interval = interval
+        self.max_workers = max_workers
+        self.watch_ttl = watch_ttl
+        self.errors = {}
+        self.updated_at = None
+        self._quotes = {}
+        self._published = {}  # symbol -> wall-clock time its latest quote was published
+        self._watchlist = {}  # symbol -> monotonic time it was last asked for
+        self._version = 0
+        self._frame = pd.DataFrame(columns=QUOTE_COLUMNS)
+        self._frame_version = 0
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def version(self):
+        return self._version
+    
+    def watch(self, symbols):
+        """Add or renew symbols on the watchlist, waking the worker if any are new"""
+        now = time.monotonic()
+        with self._lock:
+            new = [s for s in symbols if s not in self._watchlist]
+            for symbol in symbols:
+                self._watchlist[symbol] = now
+        if new:
+            self._wake.set()
+        return new
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='quote-engine', daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def refresh(self):
+        """Poll the provider once for the whole watchlist, publishing each chunk as it lands"""
+        ledgers = self.ledgers()
+        held = set()
+        for ledger in ledgers:
+            with ledger.lock:
+                held.update(ledger.aggregates.held_symbols())
+        with self._lock:
+            now = time.monotonic()
+            # Open positions keep their symbols watched, whether or not anyone is looking
+            for symbol in held:
+                self._watchlist[symbol] = now
+            self._expire(now - self.watch_ttl)
+            symbols = list(self._watchlist)
+        
+        for chunk in shard_symbols(symbols, SCAN_CHUNK_SIZE):
+            if self._stop.is_set():
+                return
+            quotes, errors = fetch_quotes(chunk, fetch=self.fetch, max_workers=self.max_workers)
+            with self._lock:
+                published = time.time()
+                for quote in quotes.to_dict('records'):
+                    self._quotes[quote['symbol']] = quote
+                    self._published[quote['symbol']] = published
+                for symbol in chunk:
+                    self.errors.pop(symbol, None)
+                self.errors.update(errors)
+                self.updated_at = datetime.now()
+                self._version += 1
+                self._updated.notify_all()
+            if ledgers and not quotes.empty:
+                prices = quotes.set_index('symbol')['last_price'].astype(float)
+                for ledger in ledgers:
+                    with ledger.lock:
+                        ledger.aggregates.mark_many(prices)
+                        self.exits += len(ledger.check_exits(prices))
+    
+    def _expire(self, cutoff):
+        # Drop symbols no session has watched since ``cutoff``, with their quotes
+        expired = [s for s, asked_at in self._watchlist.items() if asked_at < cutoff]
+        for symbol in expired:
+            del self._watchlist[symbol]
+            self._quotes.pop(symbol, None)
+            self._published.pop(symbol, None)
+            self.errors.pop(symbol, None)
+        if expired:
+            self._frame_version = -1
+    
+    def coverage(self, symbols):
+        """Number of ``symbols`` that have been fetched at least once (successfully or not)"""
+        with self._lock:
+            return sum(1 for s in symbols if s in self._quotes or s in self.errors)
+    
+    def published_at(self, symbols):
+        """Wall-clock publish time of each symbol's latest quote, as a Series indexed by symbol"""
+        with self._lock:
+            return pd.Series({s: self._published[s] for s in symbols if s in self._published}, dtype=float)
+    
+    def wait_for_update(self, version, timeout=None):
+        """Block until the table is newer than ``version``; returns the current version"""
+        with self._updated:
+            self._updated.wait_for(lambda: self._version > version, timeout)
+            return self._version
+    
+    def snapshot(self, symbols=None):
+        """Return the latest quotes as a frame, optionally restricted to ``symbols``"""
+        with self._lock:
+            if self._frame_version != self._version:
+                self._frame = pd.DataFrame(list(self._quotes.values()), columns=QUOTE_COLUMNS)
+                self._frame_version = self._version
+            frame = self._frame
+        if symbols is None:
+            return frame
+        return frame[frame['symbol'].isin(symbols)]
+
+@st.cache_resource
+def get_quote_engine():
+    """Process-wide quote engine, started on first use"""
+    cache = get_quote_cache()
+    # Polls go through the shared cache so they refresh it and coalesce with session misses
+    return QuoteEngine(fetch=lambda symbol: cache.get(symbol, force=True), ledgers=get_journal().ledgers).start()
+
+def signal_sides(imbalance, buy_threshold, sell_threshold):
+    """Map an array of imbalances to 'BUY', 'SELL' or '' (no signal)"""
+    imbalance = np.asarray(imbalance, dtype=float)
+    return np.select(
+        [imbalance >= buy_threshold, imbalance <= sell_threshold],
+        ['BUY', 'SELL'],
+        default=''
+    )
+
+def compute_signals(quotes, buy_threshold, sell_threshold):
+    """Vectorized signal stage: a columnar quote frame in, one row per opportunity out"""
+    side = signal_sides(quotes['imbalance'].to_numpy(), buy_threshold, sell_threshold)
+    selected = side != ''
+    signals = quotes[selected]
+    side = side[selected]
+    return pd.DataFrame({
+        'timestamp': pd.Timestamp.now(),
+        'symbol': signals['symbol'].to_numpy(),
+        'company': signals['company'].to_numpy(),
+        'side': side,
+        'price': signals['last_price'].to_numpy(dtype=float),
+        'imbalance': signals['imbalance'].to_numpy(dtype=float),
+        'volume': np.where(side == 'BUY', signals['bid_volume'].to_numpy(dtype=float),
+                           signals['ask_volume'].to_numpy(dtype=float)),
+        'spread_pct': signals['spread_pct'].to_numpy(dtype=float),
+        'liquidity': signals['liquidity'].to_numpy(dtype=float),
+        **{column: signals[column].to_numpy(dtype=float) for column in FEATURE_COLUMNS}
+    })
+
+def get_price_snapshot(symbols):
+    """Latest price per symbol as a Series: engine quotes, plus one batched cache fetch for any gaps"""
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return pd.Series(dtype=float)
+    # Prices asked for here back open positions, so they outrank the watchlist upstream
+    get_fetch_scheduler().prioritize(symbols)
+    engine = get_quote_engine()
+    engine.watch(symbols)
+    quotes = engine.snapshot(symbols)
+    missing = [s for s in symbols if s not in set(quotes['symbol'])]
+    if missing:
+        fetched, _ = fetch_quotes(missing, fetch=get_quote_cache().get)
+        if not fetched.empty:
+            quotes = fetched if quotes.empty else pd.concat([quotes, fetched], ignore_index=True)
+    return quotes.drop_duplicates('symbol').set_index('symbol')['last_price'].astype(float)
+
+def held_prices(ledger):
+    """Prices for the ledger's held symbols, shared by every panel until the quote engine publishes again"""
+    symbols = ledger.aggregates.held_symbols()
+    key = (ledger.account, get_quote_engine().version)
+    cached = st.session_state.held_prices
+    if cached is None or cached[0] != key or not set(symbols) <= set(cached[1].index):
+        cached = st.session_state.held_prices = (key, get_price_snapshot(symbols))
+    return cached[1]
+
+@timed('get_trading_opportunities')
+def get_trading_opportunities(symbols, buy_threshold, sell_threshold, fetch=None):
+    """Get trading opportunities based on order book imbalance
+
+    Reads the shared quote engine's snapshot by default. Pass ``fetch`` (a
+    callable symbol -> quote dict) to fetch directly instead, e.g. with a fake
+    provider when running without network access.
+    """
+    if fetch is None:
+        engine = get_quote_engine()
+        version = engine.version
+        if engine.watch(symbols) or version == 0:
+            # Newly watched symbols (or a cold start): wait for the next fill
+            engine.wait_for_update(version, timeout=QUOTE_REFRESH_SECONDS)
+        requested = set(symbols)
+        errors = {s: m for s, m in list(engine.errors.items()) if s in requested}
+        if len(errors) > 5:
+            st.error(f"Error fetching data for {len(errors)} symbols, e.g. {', '.join(list(errors)[:5])}")
+        else:
+            for symbol, message in errors.items():
+                st.error(f"Error fetching data for {symbol}: {message}")
+        quotes = engine.snapshot(symbols)
+        return compute_signals(quotes, buy_threshold, sell_threshold)
+    
+    frames = list(scan_opportunities(symbols, buy_threshold, sell_threshold, fetch))
+    if not frames:
+        return compute_signals(pd.DataFrame(columns=QUOTE_COLUMNS), buy_threshold, sell_threshold)
+    return pd.concat(frames, ignore_index=True)
+
+def scan_opportunities(symbols, buy_threshold, sell_threshold, fetch=None, chunk_size=SCAN_CHUNK_SIZE):
+    """Fetch and evaluate ``symbols`` shard by shard, yielding each shard's opportunities"""
+    for chunk in shard_symbols(symbols, chunk_size):
+        quotes, _ = fetch_quotes(chunk, fetch=fetch)
+        yield compute_signals(quotes, buy_threshold, sell_threshold)
+
+# Column dtypes of the trade ledger; pnl/exit fields stay NaN/NaT while a trade is open
+TRADE_FIELDS = {
+    'timestamp': 'datetime64[us]',
+    'symbol': object,
+    'company': object,
+    'side': 'U4',
+    'entry_price': 'f8',
+    'shares': 'f8',
+    'amount': 'f8',
+    'stop_loss': 'f8',
+    'take_profit': 'f8',
+    'status': 'U6',
+    'pnl': 'f8',
+    'exit_price': 'f8',
+    'exit_time': 'datetime64[us]'
+}
+
+class PortfolioAggregates:
+    """Running portfolio totals, updated in O(1) per fill and per price mark.
+
+    Unrealized PnL is kept as sum(signed_shares * last_price - signed_cost)
+    over held symbols, so marking one symbol only adjusts its own term.
+    """
+    
+    def __init__(self):
+        self.realized_pnl = 0.0
+        self.unrealized_pnl = 0.0
+        self.open_count = 0
+        self.exposure = {}  # (symbol, side) -> entry amount still at risk
+        self._positions = {}  # symbol -> [open trades, signed shares, signed cost, last price]
+        self._exposure_counts = {}
+    
+    def held_symbols(self):
+        return list(self._positions)
+    
+    def mark(self, symbol, price):
+        """Revalue a held symbol at ``price``"""
+        position = self._positions.get(symbol)
+        if position is None or price is None or not np.isfinite(price):
+            return
+        self.unrealized_pnl += position[1] * (price - position[3])
+        position[3] = price
+    
+    def mark_many(self, prices):
+        """Revalue held symbols from a symbol -> price mapping"""
+        for symbol, price in prices.items():
+            self.mark(symbol, price)
+    
+    def on_open(self, symbol, side, entry_price, shares, amount):
+        direction = 1.0 if side == 'BUY' else -1.0
+        position = self._positions.setdefault(symbol, [0, 0.0, 0.0, entry_price])
+        position[0] += 1
+        position[1] += direction * shares
+        position[2] += direction * shares * entry_price
+        self.unrealized_pnl += direction * shares * (position[3] - entry_price)
+        self.open_count += 1
+        
+        key = (symbol, side)
+        self.exposure[key] = self.exposure.get(key, 0.0) + amount
+        self._exposure_counts[key] = self._exposure_counts.get(key, 0) + 1
+    
+    def on_close(self, symbol, side, entry_price, shares, amount, exit_price, pnl):
+        self.mark(symbol, exit_price)
+        direction = 1.0 if side == 'BUY' else -1.0
+        position = self._positions[symbol]
+        self.unrealized_pnl -= direction * shares * (position[3] - entry_price)
+        position[0] -= 1
+        position[1] -= direction * shares
+        position[2] -= direction * shares * entry_price
+        if position[0] == 0:
+            del self._positions[symbol]
+        self.realized_pnl += pnl
+        self.open_count -= 1
+        if self.open_count == 0:
+            self.unrealized_pnl = 0.0  # drop accumulated rounding error
+        
+        key = (symbol, side)
+        self._exposure_counts[key] -= 1
+        if self._exposure_counts[key] == 0:
+            del self._exposure_counts[key]
+            del self.exposure[key]
+        else:
+            self.exposure[key] -= amount
+
+class ExitEngine:
+    """Stop-loss / take-profit trigger index over open positions.
+
+    Each symbol keeps four heaps ordered so the next level to trigger is on
+    top (long stops and short targets hold negated levels). A price update
+    pops exactly the triggered entries, O(log n) each. Removed trades are
+    dropped lazily when they surface, and a symbol's heaps are rebuilt once
+    stale entries outnumber live ones.
+    """
+    
+    LEGS = ('long_stop', 'long_take', 'short_stop', 'short_take')
+    
+    def __init__(self):
+        self._heaps = {}  # symbol -> {leg: heap of (key, trade id)}
+        self._active = {}  # trade id -> symbol
+        self._live = {}  # symbol -> open trades indexed
+    
+    def __len__(self):
+        return len(self._active)
+    
+    def add(self, trade_id, symbol, side, stop_loss, take_profit):
+        heaps = self._heaps.setdefault(symbol, {leg: [] for leg in self.LEGS})
+        if side == 'BUY':
+            heapq.heappush(heaps['long_stop'], (-stop_loss, trade_id))  # hit when price <= stop
+            heapq.heappush(heaps['long_take'], (take_profit, trade_id))  # hit when price >= take
+        else:
+            heapq.heappush(heaps['short_stop'], (stop_loss, trade_id))  # hit when price >= stop
+            heapq.heappush(heaps['short_take'], (-take_profit, trade_id))  # hit when price <= take
+        self._active[trade_id] = symbol
+        self._live[symbol] = self._live.get(symbol, 0) + 1
+    
+    def remove(self, trade_id):
+        symbol = self._active.pop(trade_id, None)
+        if symbol is not None:
+            self._live[symbol] -= 1
+            self._compact(symbol)
+    
+    def _compact(self, symbol):
+        heaps = self._heaps[symbol]
+        if sum(len(heap) for heap in heaps.values()) > 4 * self._live[symbol] + 32:
+            for leg, heap in heaps.items():
+                heaps[leg] = [entry for entry in heap if self._active.get(entry[1]) == symbol]
+                heapq.heapify(heaps[leg])
+    
+    def on_price(self, symbol, price):
+        """Remove and return the ids of every position on ``symbol`` triggered at ``price``"""
+        heaps = self._heaps.get(symbol)
+        if not heaps:
+            return []
+        triggered = []
+        for leg in self.LEGS:
+            heap = heaps[leg]
+            # Negated legs compare against -price so every heap triggers on key <= bound
+            bound = -price if leg in ('long_stop', 'short_take') else price
+            while heap and heap[0][0] <= bound:
+                _, trade_id = heapq.heappop(heap)
+                if self._active.get(trade_id) == symbol:
+                    del self._active[trade_id]
+                    self._live[symbol] -= 1
+                    triggered.append(trade_id)
+        if triggered:
+            self._compact(symbol)
+        return triggered
+
+class TradeLedger:
+    """Columnar, array-backed trade ledger with cash balance and an open-trade index.
+
+    Trades are rows in pre-typed NumPy columns addressed by integer id. The
+    open index keeps per-rerun work proportional to open positions rather
+    than to every fill the session has ever made.
+    """
+    
+    def __init__(self, balance, capacity=1024):
+        self.balance = balance
+        self.lock = threading.RLock()
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in TRADE_FIELDS.items()}
+        self._size = 0
+        self._open = {}  # trade id -> None, kept in insertion order
+        self.aggregates = PortfolioAggregates()
+        self.exits = ExitEngine()
+        self.journal = None  # set by TradeJournal.load_ledger
+        self.account = None
+        self._ticket = 0  # journal ticket of the latest change
+    
+    def __len__(self):
+        return self._size
+    
+    @property
+    def open_count(self):
+        return len(self._open)
+    
+    def _grow(self):
+        capacity = max(1, len(self._columns['amount'])) * 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+    
+    def add(self, symbol, company, side, entry_price, shares, amount, stop_loss, take_profit, timestamp=None):
+        """Record an open trade and debit its amount; returns the trade id or None if unaffordable"""
+        with self.lock:
+            if amount <= 0 or amount > self.balance:
+                return None
+            if self._size == len(self._columns['amount']):
+                self._grow()
+            trade_id = self._size
+            row = {
+                'timestamp': np.datetime64(timestamp or datetime.now(), 'us'),
+                'symbol': symbol,
+                'company': company,
+                'side': side,
+                'entry_price': entry_price,
+                'shares': shares,
+                'amount': amount,
+                'stop_loss': stop_loss,
+                'take_profit': take_profit,
+                'status': 'OPEN',
+                'pnl': np.nan,
+                'exit_price': np.nan,
+                'exit_time': np.datetime64('NaT')
+            }
+            for name, value in row.items():
+                self._columns[name][trade_id] = value
+            self._size += 1
+            self._open[trade_id] = None
+            self.balance -= amount
+            self.aggregates.on_open(symbol, side, entry_price, shares, amount)
+            self.exits.add(trade_id, symbol, side, stop_loss, take_profit)
+            if self.journal is not None:
+                self._ticket = self.journal.record(self.account, 'open', trade_id, {
+                    'timestamp': str(row['timestamp']), 'symbol': symbol, 'company': company, 'side': side,
+                    'entry_price': float(entry_price), 'shares': float(shares), 'amount': float(amount),
+                    'stop_loss': float(stop_loss), 'take_profit': float(take_profit)
                 })
-    return pd.DataFrame(opportunities)
+            return trade_id
+    
+    def close(self, trade_id, exit_price, exit_time=None):
+        """Close an open trade at ``exit_price`` and credit the proceeds; returns its pnl or None"""
+        with self.lock:
+            if trade_id not in self._open:
+                return None
+            columns = self._columns
+            direction = 1.0 if columns['side'][trade_id] == 'BUY' else -1.0
+            pnl = direction * (exit_price - columns['entry_price'][trade_id]) * columns['shares'][trade_id]
+            columns['exit_price'][trade_id] = exit_price
+            columns['pnl'][trade_id] = pnl
+            columns['status'][trade_id] = 'CLOSED'
+            columns['exit_time'][trade_id] = np.datetime64(exit_time or datetime.now(), 'us')
+            del self._open[trade_id]
+            self.exits.remove(trade_id)
+            self.balance += columns['amount'][trade_id] + pnl
+            self.aggregates.on_close(
+                columns['symbol'][trade_id], str(columns['side'][trade_id]),
+                columns['entry_price'][trade_id], columns['shares'][trade_id],
+                columns['amount'][trade_id], exit_price, pnl
+            )
+            if self.journal is not None:
+                self._ticket = self.journal.record(self.account, 'close', trade_id, {
+                    'exit_price': float(exit_price), 'exit_time': str(columns['exit_time'][trade_id]), 'pnl': float(pnl)
+                })
+            return float(pnl)
+    
+    def reset(self, balance):
+        """Drop every trade and restart from ``balance``"""
+        with self.lock:
+            self.balance = balance
+            self._size = 0
+            self._open = {}
+            self.aggregates = PortfolioAggregates()
+            self.exits = ExitEngine()
+            if self.journal is not None:
+                self._ticket = self.journal.record(self.account, 'reset', None, {'balance': float(balance)})
+    
+    def commit(self):
+        """Block until every change so far is durable in the journal, e.g. before reporting it"""
+        if self.journal is not None:
+            self.journal.wait(self._ticket)
+    
+    def to_snapshot(self):
+        """Serialize the ledger to bytes (npz) for journal snapshots"""
+        with self.lock:
+            arrays = {
+                name: column[:self._size].astype(str) if column.dtype == object else column[:self._size]
+                for name, column in self._columns.items()
+            }
+            buffer = io.BytesIO()
+            np.savez(buffer, balance=np.float64(self.balance), **arrays)
+            return buffer.getvalue()
+    
+    @classmethod
+    def from_snapshot(cls, blob):
+        """Rebuild a ledger, its open index, aggregates and exit engine from ``to_snapshot`` bytes"""
+        data = np.load(io.BytesIO(blob))
+        size = len(data['amount'])
+        ledger = cls(float(data['balance']), capacity=max(1024, size))
+        for name, column in ledger._columns.items():
+            column[:size] = data[name]
+        ledger._size = size
+        ledger.aggregates.realized_pnl = float(np.nansum(data['pnl']))
+        columns = ledger._columns
+        for trade_id in np.flatnonzero(data['status'] == 'OPEN'):
+            trade_id = int(trade_id)
+            symbol, side = columns['symbol'][trade_id], str(columns['side'][trade_id])
+            ledger._open[trade_id] = None
+            ledger.aggregates.on_open(symbol, side, columns['entry_price'][trade_id],
+                                      columns['shares'][trade_id], columns['amount'][trade_id])
+            ledger.exits.add(trade_id, symbol, side, columns['stop_loss'][trade_id], columns['take_profit'][trade_id])
+        return ledger
+    
+    def check_exits(self, prices):
+        """Close every open trade whose stop-loss or take-profit is hit by ``prices``
+
+        ``prices`` maps symbol -> latest price; triggered trades are closed at
+        that price. Returns the closed trade ids.
+        """
+        closed = []
+        with self.lock:
+            for symbol, price in prices.items():
+                if price is None or not np.isfinite(price):
+                    continue
+                for trade_id in self.exits.on_price(symbol, price):
+                    self.close(trade_id, price)
+                    closed.append(trade_id)
+        return closed
+    
+    def get(self, trade_id):
+        """Return one trade as a dict (None for unset pnl/exit fields)"""
+        with self.lock:
+            if not 0 <= trade_id < self._size:
+                return None
+            trade = {'id': trade_id}
+            for name, column in self._columns.items():
+                value = column[trade_id]
+                if isinstance(value, np.datetime64):
+                    value = None if np.isnat(value) else value.astype(datetime)
+                elif isinstance(value, np.floating):
+                    value = None if np.isnan(value) else float(value)
+                elif isinstance(value, np.str_):
+                    value = str(value)
+                trade[name] = value
+            return trade
+    
+    def open_ids(self):
+        with self.lock:
+            return np.fromiter(self._open, dtype=np.int64, count=len(self._open))
+    
+    def frame(self, ids=None):
+        """Trades as a DataFrame indexed by id; all trades when ``ids`` is None"""
+        with self.lock:
+            if ids is None:
+                ids = np.arange(self._size)
+            data = {name: column[ids] for name, column in self._columns.items()}
+        return pd.DataFrame(data, index=pd.Index(ids, name='id'))
+    
+    def open_trades(self):
+        return self.frame(self.open_ids())
+    
+
+class TradeJournal:
+    """Crash-safe, append-only trade journal in SQLite (WAL mode).
+
+    Every ledger open, close and reset is appended to an ``events`` log and
+    mirrored into an indexed ``trades`` table for history queries. Events
+    are group-committed: each flush writes everything buffered so far with
+    one fsync. A caller about to report a fill blocks in ``wait`` until the
+    batch holding its event is committed, flushing it at once if needed.
+    Events nobody waits for, such as engine-triggered exits, are committed
+    by a background thread every ``flush_interval`` seconds and can be lost
+    within that window. Each account's ledger is snapshotted every
+    ``snapshot_every`` events. Startup loads the latest snapshot and replays
+    only the events after it.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            trade_id INTEGER,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_account_seq ON events (account, seq);
+        CREATE TABLE IF NOT EXISTS snapshots (
+            account TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            ledger BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS trades (
+            account TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            company TEXT,
+            side TEXT NOT NULL,
+            entry_price REAL NOT NULL,
+            shares REAL NOT NULL,
+            amount REAL NOT NULL,
+            stop_loss REAL,
+            take_profit REAL,
+            status TEXT NOT NULL,
+            pnl REAL,
+            exit_price REAL,
+            exit_time TEXT,
+            PRIMARY KEY (account, id)
+        );
+        CREATE INDEX IF NOT EXISTS trades_status_time ON trades (account, status, exit_time);
+        CREATE INDEX IF NOT EXISTS trades_symbol ON trades (account, symbol, status);
+        CREATE INDEX IF NOT EXISTS trades_status_pnl ON trades (account, status, pnl);
+    """
+    
+    HISTORY_COLUMNS = ['id', 'timestamp', 'exit_time', 'symbol', 'company', 'side',
+                       'entry_price', 'exit_price', 'amount', 'pnl']
+    HISTORY_SORTS = {'exit_time', 'timestamp', 'symbol', 'pnl', 'amount'}
+    
+    def __init__(self, path=JOURNAL_PATH, flush_interval=JOURNAL_FLUSH_SECONDS, snapshot_every=JOURNAL_SNAPSHOT_EVERY):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self.SCHEMA)
+        self._pending = []
+        self._recorded = 0  # events ever recorded; ``record`` returns this as the event's ticket
+        self._committed = 0  # events ever committed, in record order
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._ledgers = {}
+        self._since_snapshot = {}
+        self._closed_symbols = {}  # account -> symbols with closed trades, kept in step by ``flush``
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def record(self, account, kind, trade_id, payload):
+        """Buffer one ledger event; returns a ticket for ``wait``"""
+        with self._pending_lock:
+            self._pending.append((account, kind, trade_id, json.dumps(payload)))
+            self._recorded += 1
+            return self._recorded
+    
+    def wait(self, ticket):
+        """Block until the event with ``ticket`` is committed, committing its batch now if it is still pending"""
+        with self._pending_lock:
+            if self._committed >= ticket:
+                return
+        # A flush already in progress holds the database lock, so this returns
+        # once that batch is in or has been committed along with newer events
+        self.flush()
+    
+    def flush(self):
+        """Commit buffered events and their trades-table updates in one transaction"""
+        with self._db_lock:
+            with self._pending_lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return 0
+            conn = self._conn
+            closed = []
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT INTO events (account, kind, trade_id, payload) VALUES (?, ?, ?, ?)", events)
+                for account, kind, trade_id, payload in events:
+                    data = json.loads(payload)
+                    if kind == 'open':
+                        conn.execute(
+                            "INSERT OR REPLACE INTO trades (account, id, timestamp, symbol, company, side, entry_price, "
+                            "shares, amount, stop_loss, take_profit, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'OPEN')",
+                            (account, trade_id, data['timestamp'], data['symbol'], data['company'], data['side'],
+                             data['entry_price'], data['shares'], data['amount'], data['stop_loss'], data['take_profit'])
+                        )
+                    elif kind == 'close':
+                        conn.execute(
+                            "UPDATE trades SET status = 'CLOSED', pnl = ?, exit_price = ?, exit_time = ? "
+                            "WHERE account = ? AND id = ?",
+                            (data['pnl'], data['exit_price'], data['exit_time'], account, trade_id)
+                        )
+                        if account in self._closed_symbols:
+                            closed.append((account, conn.execute(
+                                "SELECT symbol FROM trades WHERE account = ? AND id = ?", (account, trade_id)
+                            ).fetchone()[0]))
+                    elif kind == 'reset':
+                        conn.execute("DELETE FROM trades WHERE account = ?", (account,))
+                        closed.append((account, None))
+                conn.execute("COMMIT")
+                with self._pending_lock:
+                    self._committed += len(events)
+            except Exception:
+                conn.execute("ROLLBACK")
+                with self._pending_lock:
+                    self._pending[:0] = events
+                raise
+            for account, symbol in closed:
+                if symbol is None:
+                    self._closed_symbols.pop(account, None)
+                elif account in self._closed_symbols:
+                    self._closed_symbols[account].add(symbol)
+        
+        for account, *_ in events:
+            self._since_snapshot[account] = self._since_snapshot.get(account, 0) + 1
+        for account, count in list(self._since_snapshot.items()):
+            if count >= self.snapshot_every and account in self._ledgers:
+                self.snapshot(account)
+        return len(events)
+    
+    def snapshot(self, account):
+        """Persist the account's current ledger so startup can skip the events before it"""
+        ledger = self._ledgers[account]
+        with ledger.lock:
+            # Holding the ledger lock keeps the snapshot and the event sequence in step
+            self._since_snapshot[account] = 0
+            self.flush()
+            blob = ledger.to_snapshot()
+            with self._db_lock:
+                seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM events WHERE account = ?", (account,)).fetchone()[0]
+                self._conn.execute("INSERT OR REPLACE INTO snapshots (account, seq, ledger) VALUES (?, ?, ?)",
+                                   (account, seq, blob))
+    
+    def load_ledger(self, account, initial_balance):
+        """Rebuild an account's ledger from its latest snapshot plus the event tail, then journal it"""
+        self.flush()
+        with self._db_lock:
+            row = self._conn.execute("SELECT seq, ledger FROM snapshots WHERE account = ?", (account,)).fetchone()
+            seq, ledger = (row[0], TradeLedger.from_snapshot(row[1])) if row else (0, TradeLedger(initial_balance))
+            tail = self._conn.execute(
+                "SELECT kind, trade_id, payload FROM events WHERE account = ? AND seq > ? ORDER BY seq",
+                (account, seq)
+            ).fetchall()
+        
+        for kind, trade_id, payload in tail:
+            data = json.loads(payload)
+            if kind == 'open':
+                replayed = ledger.add(data['symbol'], data['company'], data['side'], data['entry_price'],
+                                      data['shares'], data['amount'], data['stop_loss'], data['take_profit'],
+                                      timestamp=pd.Timestamp(data['timestamp']).to_pydatetime())
+                if replayed != trade_id:
+                    raise RuntimeError(f"Journal replay for {account} diverged at trade {trade_id}")
+            elif kind == 'close':
+                ledger.close(trade_id, data['exit_price'], pd.Timestamp(data['exit_time']).to_pydatetime())
+            elif kind == 'reset':
+                ledger.reset(data['balance'])
+        
+        ledger.journal = self
+        ledger.account = account
+        self._ledgers[account] = ledger
+        self._since_snapshot[account] = len(tail)
+        return ledger
+    
+    def ledgers(self):
+        """Every ledger loaded through ``load_ledger``"""
+        return list(self._ledgers.values())
+    
+    def closed_symbols(self, account):
+        """Distinct symbols with closed trades, for history filters
+
+        Scanned from the trades table once per account, then kept in step
+        with the journal as ``flush`` commits closes and resets.
+        """
+        self.flush()
+        with self._db_lock:
+            if account not in self._closed_symbols:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT symbol FROM trades WHERE account = ? AND status = 'CLOSED'", (account,)
+                ).fetchall()
+                self._closed_symbols[account] = {row[0] for row in rows}
+            return sorted(self._closed_symbols[account])
+    
+    @staticmethod
+    def _history_where(account, symbol=None, side=None, start=None, end=None, pnl_sign=None):
+        """WHERE clause and arguments selecting an account's closed trades by the history filters"""
+        clauses, args = ["account = ?", "status = 'CLOSED'"], [account]
+        if symbol:
+            clauses.append("symbol = ?")
+            args.append(symbol)
+        if side:
+            clauses.append("side = ?")
+            args.append(side)
+        if start is not None:
+            clauses.append("exit_time >= ?")
+            args.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            clauses.append("exit_time < ?")
+            args.append((pd.Timestamp(end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+        if pnl_sign:
+            clauses.append("pnl > 0" if pnl_sign > 0 else "pnl < 0")
+        return " AND ".join(clauses), args
+    
+    def count_history(self, account, **filters):
+        """Number of closed trades matching the ``query_history`` filters"""
+        where, args = self._history_where(account, **filters)
+        self.flush()
+        with self._db_lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM trades WHERE {where}", args).fetchone()[0]
+    
+    def query_history(self, account, symbol=None, side=None, start=None, end=None, pnl_sign=None,
+                      sort_by='exit_time', descending=True, page=0, page_size=HISTORY_PAGE_SIZE, count=True):
+        """One page of closed trades, filtered and sorted in SQLite
+
+        ``start``/``end`` are dates bounding the exit time (end inclusive);
+        ``pnl_sign`` is 1 for winners and -1 for losers. Returns the page as
+        a frame and the total number of matching trades, or None for the
+        total with ``count=False`` when the caller already has it.
+        """
+        if sort_by not in self.HISTORY_SORTS:
+            raise ValueError(f"Cannot sort trade history by {sort_by}")
+        where, args = self._history_where(account, symbol, side, start, end, pnl_sign)
+        
+        self.flush()
+        with self._db_lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM trades WHERE {where}", args).fetchone()[0] if count else None
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.HISTORY_COLUMNS)} FROM trades WHERE {where} "
+                f"ORDER BY {sort_by} {'DESC' if descending else 'ASC'}, id LIMIT ? OFFSET ?",
+                args + [page_size, page * page_size]
+            ).fetchall()
+        frame = pd.DataFrame(rows, columns=self.HISTORY_COLUMNS)
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+        frame['exit_time'] = pd.to_datetime(frame['exit_time'])
+        return frame, total
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='trade-journal', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+    
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # events stay buffered and are retried on the next flush
+    
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+@st.cache_resource
+def get_journal():
+    """Process-wide trade journal"""
+    return TradeJournal().start()
+
+@st.cache_resource
+def get_account_ledger(account):
+    """Process-wide ledger for an account, restored from the journal on first use"""
+    return get_journal().load_ledger(account, DEFAULT_PARAMS['INITIAL_INVESTMENT'])
+
+def mark_to_market(open_trades, prices):
+    """Add current_price and unrealized_pnl columns to open trades, joined to ``prices`` by symbol"""
+    current_price = open_trades['symbol'].map(prices).astype(float)
+    direction = np.where(open_trades['side'] == 'BUY', 1.0, -1.0)
+    return open_trades.assign(
+        current_price=current_price,
+        unrealized_pnl=direction * (current_price - open_trades['entry_price']) * open_trades['shares']
+    )
+
+def exit_levels(price, side, stop_loss_pct, take_profit_pct):
+    """Stop-loss and take-profit prices for an entry; works on scalars or arrays"""
+    direction = np.where(np.asarray(side) == 'BUY', 1.0, -1.0)
+    stop_loss = price * (1 - direction * stop_loss_pct / 100)
+    take_profit = price * (1 + direction * take_profit_pct / 100)
+    return stop_loss, take_profit
 
-def execute_trade(symbol, side, price, company, amount, stop_loss_pct, take_profit_pct):
+def execute_trade(symbol, side, price, company, amount, stop_loss_pct, take_profit_pct, ledger=None):
     """Execute a simulated trade"""
-    if amount <= 0 or amount > st.session_state.balance:
+    ledger = ledger if ledger is not None else st.session_state.ledger
+    if amount <= 0 or price <= 0:
         return None
     
     shares = amount / price
-    stop_loss = price * (1 - stop_loss_pct/100) if side == 'BUY' else price * (1 + stop_loss_pct/100)
-    take_profit = price * (1 + take_profit_pct/100) if side == 'BUY' else price * (1 - take_profit_pct/100)
+    stop_loss, take_profit = exit_levels(price, side, stop_loss_pct, take_profit_pct)
     
-    trade = {
-        'timestamp': datetime.now(),
-        'symbol': symbol,
-        'company': company,
-        'side': side,
-        'entry_price': price,
-        'shares': shares,
-        'amount': amount,
-        'stop_loss': stop_loss,
-        'take_profit': take_profit,
-        'status': 'OPEN',
-        'pnl': None,
-        'exit_price': None
-    }
-    
-    st.session_state.trades.append(trade)
-    st.session_state.balance -= amount
-    return trade
+    trade_id = ledger.add(symbol, company, side, price, shares, amount, float(stop_loss), float(take_profit))
+    if trade_id is None:
+        return None
+    return ledger.get(trade_id)
 
-def close_trade(trade_index):
-    """Close a simulated trade"""
-    if 0 <= trade_index < len(st.session_state.trades):
-        trade = st.session_state.trades[trade_index]
-        if trade['status'] == 'OPEN':
+def close_trade(trade_id, ledger=None, price=None):
+    """Close a simulated trade, at the current market price unless ``price`` is given"""
+    ledger = ledger if ledger is not None else st.session_state.ledger
+    trade = ledger.get(trade_id)
+    if trade and trade['status'] == 'OPEN':
+        if price is None:
             current_data = get_market_data(trade['symbol'])
-            if current_data:
-                current_price = current_data['last_price']
-                if trade['side'] == 'BUY':
-                    pnl = (current_price - trade['entry_price']) * trade['shares']
-                else:
-                    pnl = (trade['entry_price'] - current_price) * trade['shares']
-                
-                trade['exit_price'] = current_price
-                trade['pnl'] = pnl
-                trade['status'] = 'CLOSED'
-                trade['exit_time'] = datetime.now()
-                st.session_state.balance += trade['amount'] + pnl
-                return trade
+            if not current_data:
+                return None
+            price = current_data['last_price']
+        if ledger.close(trade_id, price) is not None:
+            return ledger.get(trade_id)
     return None
 
+class AutoTrader:
+    """Headless trading loop that runs on its own thread, independent of UI reruns.
+
+    Every ``interval`` seconds it scans ``symbols`` for signals past the
+    buy/sell thresholds, opens trades through ``execute_trade`` (one per
+    symbol and side at a time) and closes positions that hit their
+    stop-loss or take-profit. ``params`` uses the sidebar's keys and may be
+    replaced between ticks.
+    """
+    
+    def __init__(self, ledger, symbols, params, fetch=None, interval=AUTO_TRADE_INTERVAL, engine=None):
+        self.ledger = ledger
+        self.symbols = list(symbols)
+        self.params = dict(params)
+        self.fetch = fetch
+        # Resolved now, on the caller's thread, for the same reason as in get_quote_cache
+        self.engine = engine if engine is not None or fetch is not None else get_quote_engine()
+        self.interval = interval
+        self.orders = 0
+        self.exits = 0
+        self.last_tick = None
+        self.last_error = None
+        self.latencies = deque(maxlen=1000)  # seconds from quote publish to order
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='auto-trader', daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+    
+    def _quotes(self):
+        """Quotes for ``symbols`` and the wall-clock time each was published"""
+        if self.fetch is not None:
+            quotes = fetch_quotes(self.symbols, fetch=self.fetch)[0]
+            return quotes, pd.Series(time.time(), index=quotes['symbol'], dtype=float)
+        version = self.engine.version
+        if self.engine.watch(self.symbols):
+            self.engine.wait_for_update(version, timeout=self.interval)
+        return self.engine.snapshot(self.symbols), self.engine.published_at(self.symbols)
+    
+    def tick(self):
+        """Run one scan/exit/entry cycle"""
+        params = self.params
+        quotes, published = self._quotes()
+        prices = quotes.drop_duplicates('symbol').set_index('symbol')['last_price'].astype(float)
+        
+        self.exits += len(self.ledger.check_exits(prices))
+        
+        signals = compute_signals(quotes, params['buy_threshold'], params['sell_threshold'])
+        for signal in signals.to_dict('records'):
+            # Check and fill atomically, so no other trader or manual order opens the same position in between
+            with self.ledger.lock:
+                if (signal['symbol'], signal['side']) in self.ledger.aggregates.exposure:
+                    continue
+                trade = execute_trade(
+                    signal['symbol'], signal['side'], signal['price'], signal['company'],
+                    params['amount_per_trade'], params['stop_loss_pct'], params['take_profit_pct'],
+                    ledger=self.ledger
+                )
+            if trade:
+                self.orders += 1
+                # Includes the time the quote waited in the engine before this tick read it
+                self.latencies.append(time.time() - published.get(signal['symbol'], np.nan))
+        # One journal commit for the whole tick's fills
+        self.ledger.commit()
+        self.last_tick = datetime.now()
+    
+    def latency_percentiles(self):
+        """p50/p95/p99 quote-to-order latency in milliseconds (empty before the first order)"""
+        latencies = np.fromiter(self.latencies, dtype=float)
+        latencies = latencies[np.isfinite(latencies)]
+        if not latencies.size:
+            return {}
+        values = np.percentile(latencies, [50, 95, 99]) * 1000
+        return dict(zip(['p50', 'p95', 'p99'], values))
+
+class AutoTraderRegistry:
+    """Process-wide auto traders, at most one per account.
+
+    A trader belongs to its account's ledger, not to the session that started
+    it, so it outlives that session and every session on the account sees its
+    real status and can stop it.
+    """
+    
+    def __init__(self):
+        self._traders = {}
+        self._lock = threading.Lock()
+    
+    def get(self, account):
+        """The account's running trader, or None"""
+        with self._lock:
+            trader = self._traders.get(account)
+        return trader if trader is not None and trader.running else None
+    
+    def start(self, account, ledger, symbols, params):
+        with self._lock:
+            trader = self._traders.get(account)
+            if trader is None or trader.ledger is not ledger or not trader.running:
+                if trader is not None:
+                    trader.stop()
+                trader = self._traders[account] = AutoTrader(ledger, symbols, params)
+            trader.symbols = list(symbols)
+            trader.params = dict(params)
+            return trader.start()
+    
+    def update(self, account, symbols, params):
+        trader = self.get(account)
+        if trader is not None:
+            trader.symbols = list(symbols)
+            trader.params = dict(params)
+    
+    def stop(self, account):
+        with self._lock:
+            trader = self._traders.pop(account, None)
+        if trader is not None:
+            trader.stop()
+
+@st.cache_resource
+def get_auto_traders():
+    """Process-wide auto trader registry"""
+    return AutoTraderRegistry()
+
+def sync_auto_trader(ledger, symbols, params):
+    """Apply this session's start/stop request to the account's shared auto trader; returns it"""
+    traders = get_auto_traders()
+    request = st.session_state.pop('auto_trading_request', None)
+    if request == 'stop':
+        traders.stop(ledger.account)
+        st.session_state.auto_trader_owner = None
+    elif request == 'start':
+        traders.start(ledger.account, ledger, symbols, params)
+        st.session_state.auto_trader_owner = ledger.account
+    elif st.session_state.auto_trader_owner == ledger.account:
+        # The session that started the trader keeps it on its current sidebar settings
+        traders.update(ledger.account, symbols, params)
+    return traders.get(ledger.account)
+
+class BarStore:
+    """Append-only, memory-mapped columnar store of historical bars.
+
+    Each symbol and interval gets a directory with one raw little-endian
+    file per field: int64 UTC nanoseconds for time, float64 for prices and
+    volume. Appends add bars newer than the last stored one and rewrite the
+    last stored bar in place when it comes back, since it may still have
+    been forming when stored. Reads memory-map the files and slice by time
+    without copying. The time file
+    is written last, so a crash mid-append leaves at most a partial tail
+    that the next append trims.
+    """
+    
+    FIELDS = {'time': '<i8', 'open': '<f8', 'high': '<f8', 'low': '<f8', 'close': '<f8', 'volume': '<f8'}
+    
+    def __init__(self, root=BAR_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+    
+    def _path(self, symbol, interval, field):
+        return os.path.join(self.root, interval, symbol, f"{field}.bin")
+    
+    def length(self, symbol, interval='1d'):
+        """Number of complete bars stored for a symbol"""
+        sizes = []
+        for field, dtype in self.FIELDS.items():
+            path = self._path(symbol, interval, field)
+            sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(sizes)
+    
+    def _map(self, symbol, interval, field, length):
+        if length == 0:
+            return np.empty(0, dtype=self.FIELDS[field])
+        return np.memmap(self._path(symbol, interval, field), dtype=self.FIELDS[field], mode='r', shape=(length,))
+    
+    def last_time(self, symbol, interval='1d'):
+        """Timestamp of the newest stored bar (naive UTC), or None when empty"""
+        length = self.length(symbol, interval)
+        if length == 0:
+            return None
+        return pd.Timestamp(int(self._map(symbol, interval, 'time', length)[-1]))
+    
+    def append(self, symbol, frame, interval='1d'):
+        """Append bars newer than the last stored one, refreshing that one in place; returns the number appended"""
+        if frame.empty:
+            return 0
+        index = pd.DatetimeIndex(frame.index)
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        times = index.asi8
+        order = np.argsort(times, kind='stable')
+        
+        with self._lock:
+            length = self.length(symbol, interval)
+            os.makedirs(os.path.dirname(self._path(symbol, interval, 'time')), exist_ok=True)
+            # Trim any partial tail left by an interrupted append
+            for field, dtype in self.FIELDS.items():
+                path = self._path(symbol, interval, field)
+                if os.path.exists(path) and os.path.getsize(path) != length * np.dtype(dtype).itemsize:
+                    os.truncate(path, length * np.dtype(dtype).itemsize)
+            
+            last = int(self._map(symbol, interval, 'time', length)[-1]) if length else None
+            columns = {
+                'open': frame['Open'], 'high': frame['High'], 'low': frame['Low'],
+                'close': frame['Close'], 'volume': frame.get('Volume', pd.Series(np.nan, index=frame.index))
+            }
+            if last is not None:
+                refreshed = order[times[order] == last]
+                if refreshed.size:
+                    # The time file is untouched, so an interrupted rewrite leaves a
+                    # bar that the next sync simply refreshes again
+                    for field, values in columns.items():
+                        itemsize = np.dtype(self.FIELDS[field]).itemsize
+                        with open(self._path(symbol, interval, field), 'r+b') as f:
+                            f.seek((length - 1) * itemsize)
+                            f.write(values.to_numpy(dtype=self.FIELDS[field])[refreshed[-1:]].tobytes())
+            keep = order if last is None else order[times[order] > last]
+            if keep.size == 0:
+                return 0
+            for field, values in columns.items():
+                with open(self._path(symbol, interval, field), 'ab') as f:
+                    f.write(values.to_numpy(dtype=self.FIELDS[field])[keep].tobytes())
+            with open(self._path(symbol, interval, 'time'), 'ab') as f:
+                f.write(times[keep].astype(self.FIELDS['time']).tobytes())
+            return int(keep.size)
+    
+    def read(self, symbol, interval='1d', start=None, end=None):
+        """Zero-copy, memory-mapped field arrays for bars with start <= time < end"""
+        length = self.length(symbol, interval)
+        times = self._map(symbol, interval, 'time', length)
+        lo = 0 if start is None else int(np.searchsorted(times, pd.Timestamp(start).value, 'left'))
+        hi = length if end is None else int(np.searchsorted(times, pd.Timestamp(end).value, 'left'))
+        return {field: self._map(symbol, interval, field, length)[lo:hi] for field in self.FIELDS}
+    
+    def frame(self, symbol, interval='1d', start=None, end=None):
+        """Stored bars as an OHLCV frame, e.g. for charting or backtests"""
+        arrays = self.read(symbol, interval, start, end)
+        return pd.DataFrame(
+            {'Open': arrays['open'], 'High': arrays['high'], 'Low': arrays['low'],
+             'Close': arrays['close'], 'Volume': arrays['volume']},
+            index=pd.DatetimeIndex(np.asarray(arrays['time']).astype('datetime64[ns]'))
+        )
+    
+    def sync(self, symbol, provider=None, interval='1d', period='max'):
+        """Fetch only the bars missing since the last stored one; returns the number appended"""
+        provider = provider or get_provider()
+        last = self.last_time(symbol, interval)
+        if last is None:
+            history = provider.get_history(symbol, period=period, interval=interval)
+        else:
+            # Refetch from the last stored bar so a still-forming one is refreshed. The
+            # start is tz-aware because yfinance reads a naive one in exchange time
+            history = provider.get_history(symbol, interval=interval, start=last.tz_localize('UTC'))
+        return self.append(symbol, history, interval)
+
+def strategy_params(**overrides):
+    """DEFAULT_PARAMS with the sidebar's lower-case keys, plus any overrides"""
+    params = {key.lower(): value for key, value in DEFAULT_PARAMS.items()}
+    params.update(overrides)
+    return params
+
+def bar_imbalance(high, low, close):
+    """Buy/sell pressure proxy for bars with no recorded imbalance.
+
+    Where the close sits in the bar's range, scaled to [-1, 1]: +1 closes on
+    the high, -1 on the low, 0 mid-range or for a flat bar.
+    """
+    bar_range = high - low
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(bar_range > 0, (2 * close - high - low) / bar_range, 0.0)
+
+def align_bars(frames):
+    """Align per-symbol OHLCV frames on one time index as (time x symbol) float arrays.
+
+    ``frames`` maps symbol -> frame. Missing bars are NaN; an ``imbalance``
+    column is used when recorded, otherwise ``bar_imbalance`` stands in.
+    """
+    symbols = [symbol for symbol, frame in frames.items() if not frame.empty]
+    index = pd.DatetimeIndex([])
+    for symbol in symbols:
+        index = index.union(frames[symbol].index)
+    
+    bars = {'index': index, 'symbols': symbols}
+    for field in ('Open', 'High', 'Low', 'Close'):
+        bars[field.lower()] = np.column_stack(
+            [frames[s][field].reindex(index).to_numpy(dtype=float) for s in symbols]
+        ) if symbols else np.empty((len(index), 0))
+    imbalance = bar_imbalance(bars['high'], bars['low'], bars['close'])
+    for column, symbol in enumerate(symbols):
+        if 'imbalance' in frames[symbol].columns:
+            imbalance[:, column] = frames[symbol]['imbalance'].reindex(index).to_numpy(dtype=float)
+    bars['imbalance'] = imbalance
+    return bars
+
+def load_bars(symbols, provider=None, period='max', interval='1d', store=None):
+    """Load and align historical bars for ``symbols``
+
+    With a ``store``, each symbol's missing tail is synced from the provider
+    and bars are read from disk; otherwise they are downloaded in full.
+    """
+    provider = provider or get_provider()
+    if store is None:
+        return align_bars({symbol: provider.get_history(symbol, period=period, interval=interval) for symbol in symbols})
+    for symbol in symbols:
+        store.sync(symbol, provider, interval=interval, period=period)
+    return align_bars({symbol: store.frame(symbol, interval) for symbol in symbols})
+
+def run_backtest(bars, params=None, fee_bps=BACKTEST_FEE_BPS, slippage_bps=BACKTEST_SLIPPAGE_BPS, initial_cash=None):
+    """Replay aligned bars through the imbalance strategy.
+
+    Bars are processed in time order; each step is vectorized across
+    symbols. Signals come from ``signal_sides`` and SL/TP levels from
+    ``exit_levels``, as in live trading. Positions are checked against the
+    bar close, one position per symbol at a time, sized at
+    ``amount_per_trade``. Fills pay ``slippage_bps`` against the trade and
+    ``fee_bps`` of notional on both entry and exit.
+
+    Returns a dict with an ``equity`` Series, a ``trades`` frame and ``stats``.
+    """
+    params = strategy_params(**(params or {}))
+    initial_cash = params['initial_investment'] if initial_cash is None else initial_cash
+    amount = params['amount_per_trade']
+    fee = fee_bps / 10000
+    slip = slippage_bps / 10000
+    
+    close, imbalance, symbols = bars['close'], bars['imbalance'], bars['symbols']
+    steps, width = close.shape
+    side = np.zeros(width, dtype=np.int8)
+    entry_price = np.zeros(width)
+    shares = np.zeros(width)
+    stop_loss = np.zeros(width)
+    take_profit = np.zeros(width)
+    entry_step = np.zeros(width, dtype=np.int64)
+    entry_fee = np.zeros(width)
+    last_price = np.full(width, np.nan)
+    equity = np.empty(steps)
+    cash = initial_cash
+    fills = []
+    block = 1024
+    
+    for step in range(steps):
+        price = close[step]
+        valid = np.isfinite(price)
+        last_price = np.where(valid, price, last_price)
+        
+        held = side != 0
+        hit = held & valid & np.where(
+            side > 0,
+            (price <= stop_loss) | (price >= take_profit),
+            (price >= stop_loss) | (price <= take_profit)
+        )
+        if hit.any():
+            columns = np.flatnonzero(hit)
+            direction = side[columns]
+            exit_price = price[columns] * (1 - direction * slip)
+            gross = direction * (exit_price - entry_price[columns]) * shares[columns]
+            exit_fee = exit_price * shares[columns] * fee
+            cash += float(np.sum(amount + gross - exit_fee))
+            fills.append((columns, direction, entry_step[columns], np.full(len(columns), step),
+                          entry_price[columns], exit_price, shares[columns],
+                          gross - exit_fee - entry_fee[columns]))
+            side[columns] = 0
+        
+        if step % block == 0:
+            # Evaluate signals for a block of bars at once to amortize per-call overhead
+            block_sides = signal_sides(imbalance[step:step + block], params['buy_threshold'], params['sell_threshold'])
+        sides = block_sides[step % block]
+        wanted = np.flatnonzero((side == 0) & valid & (sides != ''))
+        affordable = int(cash // (amount * (1 + fee))) if amount > 0 else 0
+        if wanted.size and affordable > 0:
+            columns = wanted[:affordable]
+            direction = np.where(sides[columns] == 'BUY', 1, -1).astype(np.int8)
+            fill_price = price[columns] * (1 + direction * slip)
+            side[columns] = direction
+            entry_price[columns] = fill_price
+            shares[columns] = amount / fill_price
+            stop_loss[columns], take_profit[columns] = exit_levels(
+                fill_price, sides[columns], params['stop_loss_pct'], params['take_profit_pct'])
+            entry_step[columns] = step
+            entry_fee[columns] = amount * fee
+            cash -= len(columns) * amount * (1 + fee)
+        
+        open_value = np.where(side != 0, amount + side * (last_price - entry_price) * shares, 0.0)
+        equity[step] = cash + float(np.nansum(open_value))
+    
+    index = bars['index']
+    if fills:
+        columns, direction, entered, exited, entry, exit_, size, pnl = (np.concatenate(f) for f in zip(*fills))
+        trades = pd.DataFrame({
+            'symbol': np.asarray(symbols, dtype=object)[columns],
+            'side': np.where(direction > 0, 'BUY', 'SELL'),
+            'timestamp': index[entered],
+            'exit_time': index[exited],
+            'entry_price': entry,
+            'exit_price': exit_,
+            'shares': size,
+            'pnl': pnl
+        })
+    else:
+        trades = pd.DataFrame(columns=['symbol', 'side', 'timestamp', 'exit_time',
+                                       'entry_price', 'exit_price', 'shares', 'pnl'])
+    equity = pd.Series(equity, index=index, name='equity')
+    return {'equity': equity, 'trades': trades, 'stats': backtest_stats(equity, trades, initial_cash)}
+
+def backtest_stats(equity, trades, initial_cash):
+    """Summary statistics for a backtest equity curve and its closed trades"""
+    final = float(equity.iloc[-1]) if len(equity) else initial_cash
+    drawdown = (equity / equity.cummax() - 1).min() if len(equity) else 0.0
+    returns = equity.pct_change().dropna()
+    return {
+        'final_equity': final,
+        'total_return_pct': (final / initial_cash - 1) * 100 if initial_cash else 0.0,
+        'max_drawdown_pct': float(drawdown) * 100,
+        'sharpe_per_bar': float(returns.mean() / returns.std()) if returns.std() > 0 else 0.0,
+        'trades': len(trades),
+        'win_rate': float((trades['pnl'] > 0).mean()) if len(trades) else 0.0
+    }
+
+def parameter_grid(grid):
+    """Expand {param: [values]} into a list of parameter dicts (cartesian product)"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def _share_bars(bars, directory):
+    """Write aligned bars as .npy files that sweep workers memory-map instead of unpickling"""
+    for field in ('open', 'high', 'low', 'close', 'imbalance'):
+        np.save(os.path.join(directory, f"{field}.npy"), np.ascontiguousarray(bars[field]))
+    np.save(os.path.join(directory, 'index.npy'), bars['index'].asi8)
+    with open(os.path.join(directory, 'symbols.json'), 'w') as f:
+        json.dump(list(bars['symbols']), f)
+
+_shared_bars = {}  # per worker process: directory -> memory-mapped bars
+
+def _load_shared_bars(directory):
+    if directory not in _shared_bars:
+        bars = {field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode='r')
+                for field in ('open', 'high', 'low', 'close', 'imbalance')}
+        bars['index'] = pd.DatetimeIndex(np.load(os.path.join(directory, 'index.npy')))
+        with open(os.path.join(directory, 'symbols.json')) as f:
+            bars['symbols'] = json.load(f)
+        _shared_bars[directory] = bars
+    return _shared_bars[directory]
+
+def _sweep_worker(directory, param_sets, fee_bps, slippage_bps):
+    bars = _load_shared_bars(directory)
+    rows = []
+    for params in param_sets:
+        stats = run_backtest(bars, params, fee_bps=fee_bps, slippage_bps=slippage_bps)['stats']
+        rows.append({**params, **stats})
+    return rows
+
+def run_sweep(bars, grid, max_workers=None, fee_bps=BACKTEST_FEE_BPS, slippage_bps=BACKTEST_SLIPPAGE_BPS,
+              rank_by='total_return_pct'):
+    """Backtest every parameter combination in ``grid`` across a process pool.
+
+    Bars are written once to a temporary directory and memory-mapped by each
+    worker, so they are shared through the page cache rather than pickled
+    per task. Combinations are dealt round-robin into one batch per worker,
+    so neighbouring grid points, which tend to cost alike, spread evenly.
+    Returns one row per combination, best ``rank_by`` first, with a ``rank``
+    column.
+    """
+    param_sets = parameter_grid(grid)
+    max_workers = max_workers or os.cpu_count() or 1
+    batches = [param_sets[i::max_workers] for i in range(max_workers) if param_sets[i::max_workers]]
+    
+    with tempfile.TemporaryDirectory(prefix='strm-sweep-') as directory:
+        _share_bars(bars, directory)
+        with ProcessPoolExecutor(max_workers=len(batches) or 1) as pool:
+            futures = [pool.submit(_sweep_worker, directory, batch, fee_bps, slippage_bps) for batch in batches]
+            rows = [row for future in futures for row in future.result()]
+    
+    results = pd.DataFrame(rows)
+    if results.empty:
+        return results
+    results = results.sort_values(rank_by, ascending=False, ignore_index=True)
+    results.insert(0, 'rank', np.arange(1, len(results) + 1))
+    return results
+
+def init_session_state():
+    """Initialize session state"""
+    if 'auto_trader_owner' not in st.session_state:
+        st.session_state.auto_trader_owner = None  # account whose trader this session started
+    if 'order_book_data' not in st.session_state:
+        st.session_state.order_book_data = pd.DataFrame()
+    if 'position_view' not in st.session_state:
+        st.session_state.position_view = pd.DataFrame()
+    if 'flash' not in st.session_state:
+        st.session_state.flash = []
+    if 'held_prices' not in st.session_state:
+        st.session_state.held_prices = None  # (account, engine version) and the prices read at it
+
 def main():
     st.set_page_config(layout="wide", page_title="Stock Market Trader")
+    init_session_state()
     
     # Sidebar controls
     with st.sidebar:
         st.title("Trading Parameters")
+        account = st.text_input("Account", value="default",
+                                help="Trades are journaled per account and restored after restarts")
+        ledger = st.session_state.ledger = get_account_ledger(account.strip() or "default")
         params = {
             'initial_investment': st.number_input("Initial Investment (₹)", 
                                                 value=DEFAULT_PARAMS['INITIAL_INVESTMENT'], 
@@ -155,131 +2727,282 @@ def main():
                                           step=0.05),
             'sell_threshold': st.number_input("Sell Threshold", 
                                            value=DEFAULT_PARAMS['SELL_THRESHOLD'], 
-                                           step=0.05)
+                                           step=0.05),
+            'universe': st.selectbox("Symbol Universe", list_universes())
         }
         
         if st.button("Reset Portfolio"):
-            st.session_state.balance = params['initial_investment']
-            st.session_state.trades = []
+            ledger.reset(params['initial_investment'])
+            ledger.commit()
             st.success("Portfolio reset!")
+        
+        cache_stats = get_quote_cache().stats()
+        st.caption(
+            f"Quote cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['coalesced']} coalesced ({cache_stats['hit_ratio']:.0%} served without a fetch)"
+        )
+        upstream = get_fetch_scheduler().stats()
+        st.caption(
+            f"Upstream: {upstream['dispatched']} requests, {upstream['queued']} queued, "
+            f"{upstream['backing_off']} symbols backing off"
+            + (f", throttled for {upstream['throttled_for']:.0f}s" if upstream['throttled_for'] else "")
+        )
+        show_timings = st.checkbox("Show stage timings", key="show_timings")
+    start_metrics_export()
     
     # Main dashboard
     st.title("📈 Stock Market Order Book Imbalance Trader")
     
-    # Auto trading toggle
+    try:
+        stock_symbols = load_universe(params['universe'])
+    except Exception as e:
+        st.error(f"Error loading universe {params['universe']}: {str(e)}")
+        stock_symbols = list(DEFAULT_SYMBOLS)
+    trader = sync_auto_trader(ledger, stock_symbols, params)
+    
+    # Auto trading toggle; the trader runs per account, whichever session started it
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("Start Auto Trading" if not st.session_state.auto_trading else "Stop Auto Trading"):
-            st.session_state.auto_trading = not st.session_state.auto_trading
+        if st.button("Start Auto Trading" if trader is None else "Stop Auto Trading"):
+            st.session_state.auto_trading_request = 'start' if trader is None else 'stop'
             st.rerun()
     with col2:
         if st.button("Refresh Data"):
             st.rerun()
     
-    st.subheader(f"Auto Trading Status: {'🟢 ACTIVE' if st.session_state.auto_trading else '🔴 INACTIVE'}")
+    st.subheader(f"Auto Trading Status: {'🟢 ACTIVE' if trader is not None else '🔴 INACTIVE'}")
+    
+    for kind, message in st.session_state.flash:
+        getattr(st, kind)(message)
+    st.session_state.flash = []
     
-    # Portfolio summary
+    # Each panel is a fragment that refreshes on its own timer, so a price tick
+    # re-renders only that panel instead of rerunning the whole script
+    summary_panel(ledger, params)
+    opportunities_panel(stock_symbols, params)
+    positions_panel(ledger)
+    history_panel(ledger)
+    if show_timings:
+        timings_panel()
+
+def flash(message, kind='success'):
+    """Queue a message to show after the next full rerun"""
+    st.session_state.flash.append((kind, message))
+
+@st.fragment(run_every=QUOTE_REFRESH_SECONDS)
+@timed('summary_panel')
+def summary_panel(ledger, params):
+    """Portfolio summary, marked to the latest quotes"""
     st.subheader("💰 Portfolio Summary")
-    total_pnl = sum(t.get('pnl', 0) for t in st.session_state.trades)
+    aggregates = ledger.aggregates
+    prices = held_prices(ledger)
+    with ledger.lock:
+        aggregates.mark_many(prices)
+        exited = ledger.check_exits(prices)
+    if exited:
+        st.info(f"Stop-loss / take-profit closed {len(exited)} position(s)")
+    total_pnl = aggregates.realized_pnl + aggregates.unrealized_pnl
     pnl_percent = (total_pnl / params['initial_investment']) * 100 if params['initial_investment'] > 0 else 0
     
-    metric_col1, metric_col2, metric_col3 = st.columns(3)
+    metric_col1, metric_col2, metric_col3, metric_col4 = st.columns(4)
     with metric_col1:
-        st.metric("Current Balance", f"₹{st.session_state.balance:,.2f}")
+        st.metric("Current Balance", f"₹{ledger.balance:,.2f}")
     with metric_col2:
         st.metric("Total PnL", f"₹{total_pnl:,.2f}", f"{pnl_percent:.2f}%")
     with metric_col3:
-        open_trades = len([t for t in st.session_state.trades if t['status'] == 'OPEN'])
-        st.metric("Open Positions", open_trades)
-    
-    # Trading opportunities
+        st.metric("Realized / Unrealized", f"₹{aggregates.realized_pnl:,.2f}",
+                  f"₹{aggregates.unrealized_pnl:,.2f} open", delta_color="off")
+    with metric_col4:
+        st.metric("Open Positions", aggregates.open_count)
+
+@st.fragment(run_every=QUOTE_REFRESH_SECONDS)
+@timed('opportunities_panel')
+def opportunities_panel(stock_symbols, params):
+    """Signal scan over the universe, with order entry"""
     st.subheader("🔍 Trading Opportunities")
-    # Changed to Indian stocks (NSE symbols with .NS suffix for Yahoo Finance)
-    stock_symbols = ['RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS', 'INFY.NS', 
-                    'HINDUNILVR.NS', 'ICICIBANK.NS', 'ITC.NS', 
-                    'KOTAKBANK.NS', 'BHARTIARTL.NS', 'LT.NS']
+    trader = get_auto_traders().get(st.session_state.ledger.account)
+    if trader is not None:
+        latency = trader.latency_percentiles()
+        st.caption(
+            f"Auto trader: {trader.orders} orders, {trader.exits} SL/TP exits"
+            + (f", last scan {trader.last_tick:%H:%M:%S}" if trader.last_tick else "")
+            + (f", quote-to-order p50 {latency['p50'] / 1000:.1f}s / p99 {latency['p99'] / 1000:.1f}s" if latency else "")
+        )
+        if trader.last_error:
+            st.error(f"Auto trader error: {trader.last_error}")
     
+    shown_opportunities = st.session_state.order_book_data
     try:
         with st.spinner("Loading market data..."):
-            opportunities = get_trading_opportunities(
+            st.session_state.order_book_data = get_trading_opportunities(
                 stock_symbols, 
                 params['buy_threshold'], 
                 params['sell_threshold']
             )
-            st.session_state.order_book_data = opportunities
     except Exception as e:
         st.error(f"Error loading market data: {str(e)}")
         st.session_state.order_book_data = pd.DataFrame()
     
-    if not st.session_state.order_book_data.empty:
-        st.dataframe(
-            st.session_state.order_book_data,
-            column_config={
-                "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-                "imbalance": st.column_config.NumberColumn("Imbalance", format="%.3f"),
-                "spread_pct": st.column_config.NumberColumn("Spread %", format="%.2f%%"),
-                "liquidity": st.column_config.NumberColumn("Liquidity", format="₹%.0f")
-            },
-            hide_index=True,
-            use_container_width=True
-        )
-        
-        # Trade execution
-        for idx, row in st.session_state.order_book_data.iterrows():
-            if st.button(
-                f"{row['side']} {row['symbol']} @ {row['price']:.2f}", 
-                key=f"trade_{idx}",
-                type="primary" if row['side'] == 'BUY' else "secondary"
-            ):
-                trade = execute_trade(
-                    row['symbol'],
-                    row['side'],
-                    row['price'],
-                    row['company'],
-                    params['amount_per_trade'],
-                    params['stop_loss_pct'],
-                    params['take_profit_pct']
-                )
-                if trade:
-                    st.success(f"Trade executed: {trade['side']} {trade['symbol']} ({trade['company']})")
-                else:
-                    st.error("Failed to execute trade - check your balance")
+    engine = get_quote_engine()
+    if engine.updated_at:
+        st.caption(f"Quotes as of {engine.updated_at:%H:%M:%S}, refreshed every {QUOTE_REFRESH_SECONDS}s")
+    loaded = engine.coverage(stock_symbols)
+    if loaded < len(stock_symbols):
+        st.progress(loaded / len(stock_symbols),
+                    text=f"Scanned {loaded} of {len(stock_symbols)} symbols - refresh to see the rest")
+    
+    if st.session_state.order_book_data.empty:
+        return
+    # One selectable table plus an order ticket keeps the widget count flat,
+    # however many signals the scan returns
+    selection = st.dataframe(
+        st.session_state.order_book_data,
+        column_config={
+            "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+            "imbalance": st.column_config.NumberColumn("Imbalance", format="%.3f"),
+            "spread_pct": st.column_config.NumberColumn("Spread %", format="%.2f%%"),
+            "liquidity": st.column_config.NumberColumn("Liquidity", format="₹%.0f"),
+            "vwap": st.column_config.NumberColumn("VWAP", format="₹%.2f"),
+            "volatility_pct": st.column_config.NumberColumn("Realized vol %", format="%.2f%%"),
+            "range_pct": st.column_config.NumberColumn("Range %", format="%.2f%%"),
+            "volume_z": st.column_config.NumberColumn("Volume z", format="%.2f")
+        },
+        hide_index=True,
+        use_container_width=True,
+        key="opportunity_table",
+        on_select="rerun",
+        selection_mode="multi-row"
+    )
+    # Selected rows are positions in the table as last shown, which a refresh
+    # may have reordered since
+    selected = shown_opportunities.iloc[
+        [row for row in selection.selection.rows if row < len(shown_opportunities)]
+    ]
     
-    # Open positions
+    ticket_col1, ticket_col2 = st.columns([1, 3])
+    with ticket_col1:
+        submitted = st.button(
+            f"Execute {len(selected)} selected", key="execute_selected",
+            type="primary", disabled=selected.empty
+        )
+    with ticket_col2:
+        st.caption(f"₹{params['amount_per_trade']:,.0f} per trade, SL {params['stop_loss_pct']}% / TP {params['take_profit_pct']}%")
+    if submitted:
+        executed = []
+        for row in selected.to_dict('records'):
+            trade = execute_trade(
+                row['symbol'],
+                row['side'],
+                row['price'],
+                row['company'],
+                params['amount_per_trade'],
+                params['stop_loss_pct'],
+                params['take_profit_pct']
+            )
+            if trade:
+                executed.append(f"{trade['side']} {trade['symbol']}")
+        # Report only trades that would survive a crash
+        st.session_state.ledger.commit()
+        if executed:
+            flash(f"Trades executed: {', '.join(executed)}")
+        if len(executed) < len(selected):
+            flash(f"{len(selected) - len(executed)} trade(s) failed - check your balance", 'error')
+        # The summary and positions panels need to see the new trades
+        st.rerun()
+
+@st.fragment(run_every=QUOTE_REFRESH_SECONDS)
+@timed('positions_panel')
+def positions_panel(ledger):
+    """Open positions, marked to market in one batch"""
     st.subheader("📊 Open Positions")
-    open_trades = [t for t in st.session_state.trades if t['status'] == 'OPEN']
-    
-    if open_trades:
-        for idx, trade in enumerate(open_trades):
-            cols = st.columns([3, 2, 2, 1])
-            with cols[0]:
-                st.write(f"**{trade['symbol']}** ({trade['company']})")
-                st.write(f"{trade['side']} {trade['shares']:.2f} shares @ ₹{trade['entry_price']:.2f}")
-            with cols[1]:
-                st.write("**SL/TP**")
-                st.write(f"₹{trade['stop_loss']:.2f} / ₹{trade['take_profit']:.2f}")
-            with cols[2]:
-                current_price = get_market_data(trade['symbol'])['last_price']
-                pnl = (current_price - trade['entry_price']) * trade['shares'] if trade['side'] == 'BUY' \
-                      else (trade['entry_price'] - current_price) * trade['shares']
-                st.write("**Current PnL**")
-                st.write(f"₹{pnl:.2f}")
-            with cols[3]:
-                if st.button("Close", key=f"close_{idx}"):
-                    closed_trade = close_trade(idx)
-                    if closed_trade:
-                        st.success(f"Closed with PnL: ₹{closed_trade['pnl']:.2f}")
-                    st.rerun()
-    else:
+    shown_positions = st.session_state.position_view
+    open_trades = mark_to_market(ledger.open_trades(), held_prices(ledger))
+    st.session_state.position_view = open_trades
+    
+    if open_trades.empty:
         st.info("No open positions")
+        return
+    selection = st.dataframe(
+        open_trades[['symbol', 'company', 'side', 'shares', 'entry_price', 'stop_loss', 'take_profit',
+                     'current_price', 'unrealized_pnl', 'timestamp']],
+        column_config={
+            "shares": st.column_config.NumberColumn("Shares", format="%.2f"),
+            "entry_price": st.column_config.NumberColumn("Entry", format="₹%.2f"),
+            "stop_loss": st.column_config.NumberColumn("Stop loss", format="₹%.2f"),
+            "take_profit": st.column_config.NumberColumn("Take profit", format="₹%.2f"),
+            "current_price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+            "unrealized_pnl": st.column_config.NumberColumn("PnL", format="₹%.2f"),
+            "timestamp": st.column_config.DatetimeColumn("Opened", format="DD MMM HH:mm:ss")
+        },
+        hide_index=True,
+        use_container_width=True,
+        key="position_table",
+        on_select="rerun",
+        selection_mode="multi-row"
+    )
+    selected = shown_positions.iloc[
+        [row for row in selection.selection.rows if row < len(shown_positions)]
+    ]
     
-    # Trade history
+    if st.button(f"Close {len(selected)} selected", key="close_selected", disabled=selected.empty):
+        closed, total_pnl = 0, 0.0
+        for trade_id, price in zip(selected.index, selected['current_price']):
+            # Close at the marked price when there is one, else fetch a quote
+            closed_trade = close_trade(trade_id, price=None if np.isnan(price) else float(price))
+            if closed_trade:
+                closed += 1
+                total_pnl += closed_trade['pnl']
+        ledger.commit()
+        if closed:
+            flash(f"Closed {closed} position(s) with PnL: ₹{total_pnl:.2f}")
+        if closed < len(selected):
+            flash(f"{len(selected) - closed} position(s) could not be closed", 'error')
+        st.rerun()
+
+@st.fragment(run_every=HISTORY_REFRESH_SECONDS)
+@timed('history_panel')
+def history_panel(ledger):
+    """Paginated trade history from the journal"""
     st.subheader("📋 Trade History")
-    closed_trades = [t for t in st.session_state.trades if t['status'] == 'CLOSED']
+    journal, account = ledger.journal, ledger.account
+    filter_cols = st.columns([2, 1, 2, 1, 2])
+    with filter_cols[0]:
+        history_symbol = st.selectbox("Symbol", ["All"] + journal.closed_symbols(account), key="history_symbol")
+    with filter_cols[1]:
+        history_side = st.selectbox("Side", ["All", "BUY", "SELL"], key="history_side")
+    with filter_cols[2]:
+        history_dates = st.date_input("Closed between", value=(), key="history_dates")
+    with filter_cols[3]:
+        history_pnl = st.selectbox("PnL", ["All", "Winners", "Losers"], key="history_pnl")
+    with filter_cols[4]:
+        history_sort = st.selectbox("Sort by", ["Newest exit", "Oldest exit", "Best PnL", "Worst PnL", "Symbol"],
+                                    key="history_sort")
+    sort_by, descending = {
+        "Newest exit": ('exit_time', True),
+        "Oldest exit": ('exit_time', False),
+        "Best PnL": ('pnl', True),
+        "Worst PnL": ('pnl', False),
+        "Symbol": ('symbol', False)
+    }[history_sort]
+    history_filters = {
+        'symbol': None if history_symbol == "All" else history_symbol,
+        'side': None if history_side == "All" else history_side,
+        'start': history_dates[0] if len(history_dates) > 0 else None,
+        'end': history_dates[1] if len(history_dates) > 1 else None,
+        'pnl_sign': {"All": None, "Winners": 1, "Losers": -1}[history_pnl]
+    }
+    
+    total = journal.count_history(account, **history_filters)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key="history_page") - 1
+    closed_trades, _ = journal.query_history(account, page=page, count=False,
+                                             sort_by=sort_by, descending=descending, **history_filters)
     
-    if closed_trades:
+    if not closed_trades.empty:
+        st.caption(f"Showing {page * HISTORY_PAGE_SIZE + 1}-{page * HISTORY_PAGE_SIZE + len(closed_trades)} "
+                   f"of {total} closed trades")
         st.dataframe(
-            pd.DataFrame(closed_trades)[[
+            closed_trades[[
                 'timestamp', 'symbol', 'company', 'side', 
                 'entry_price', 'exit_price', 'amount', 'pnl'
             ]],
@@ -294,7 +3017,31 @@ def main():
             use_container_width=True
         )
     else:
-        st.info("No trade history yet")
+        filtered = any(value is not None for value in history_filters.values())
+        st.info("No trades match these filters" if filtered else "No trade history yet")
+
+@st.fragment(run_every=QUOTE_REFRESH_SECONDS)
+def timings_panel():
+    """Debug view of per-stage latency percentiles and cache hit ratios"""
+    st.subheader("⏱️ Stage Timings")
+    summary = get_metrics().summary()
+    if summary:
+        frame = pd.DataFrame.from_dict(summary, orient='index')
+        frame[['p50', 'p95', 'p99']] *= 1000
+        st.dataframe(
+            frame[['count', 'p50', 'p95', 'p99']],
+            column_config={
+                quantile: st.column_config.NumberColumn(f"{quantile} (ms)", format="%.1f")
+                for quantile in ('p50', 'p95', 'p99')
+            },
+            use_container_width=True
+        )
+    gauges = metrics_gauges(get_quote_cache(), get_metadata_store(), get_provider(), get_fetch_scheduler())
+    st.caption(
+        f"Quote cache hit ratio {gauges['quote_cache_hit_ratio']:.0%} ({gauges['quote_cache_entries']} entries), "
+        f"metadata cache hit ratio {gauges['metadata_cache_hit_ratio']:.0%} ({gauges['metadata_cache_entries']} entries)"
+        + (f" - exported to {METRICS_PATH}" if METRICS_PATH else "")
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,531 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import strm
+
+DEPTH_FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'depth.jsonl')
+
+class FakeProvider(strm.MarketDataProvider):
+    """Fixed daily bars and imbalances per symbol, no network"""
+    
+    def __init__(self, imbalances, price=100.0):
+        self.imbalances = imbalances
+        self.price = price
+        self.history_calls = 0
+    
+    def get_history(self, symbol, period='1d', interval='1d', start=None):
+        self.history_calls += 1
+        if symbol not in self.imbalances:
+            return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        return pd.DataFrame({'Open': [self.price], 'High': [self.price * 1.01], 'Low': [self.price * 0.99],
+                             'Close': [self.price], 'Volume': [1000.0]},
+                            index=pd.DatetimeIndex(['2024-06-28']))
+    
+    def get_metadata(self, symbol):
+        return {'company': f"{symbol} Ltd", 'sector': None, 'lot_size': 1}
+    
+    def get_imbalance(self, symbol, bars):
+        if self.imbalances[symbol] is None:
+            raise ValueError(f"no book for {symbol}")
+        return self.imbalances[symbol]
+
+def fake_fetch(provider):
+    return lambda symbol: strm.fetch_quote(symbol, provider=provider)
+
+def test_fetch_quotes_collects_rows_and_errors():
+    provider = FakeProvider({'AAA.NS': 0.5, 'BBB.NS': None})
+    quotes, errors = strm.fetch_quotes(['AAA.NS', 'BBB.NS', 'CCC.NS', 'AAA.NS'], fetch=fake_fetch(provider))
+    
+    assert list(quotes['symbol']) == ['AAA.NS']
+    assert quotes.loc[0, 'company'] == 'AAA.NS Ltd'
+    assert quotes.loc[0, 'bid_volume'] == pytest.approx(1500.0)
+    assert list(errors) == ['BBB.NS']
+    assert list(quotes.columns) == strm.QUOTE_COLUMNS
+
+def test_get_trading_opportunities_with_fetch():
+    provider = FakeProvider({'AAA.NS': 0.5, 'BBB.NS': -0.4, 'CCC.NS': 0.05})
+    opportunities = strm.get_trading_opportunities(['AAA.NS', 'BBB.NS', 'CCC.NS'], 0.2, -0.2,
+                                                   fetch=fake_fetch(provider))
+    
+    assert dict(zip(opportunities['symbol'], opportunities['side'])) == {'AAA.NS': 'BUY', 'BBB.NS': 'SELL'}
+    # BUY signals report the bid volume, SELL signals the ask volume
+    assert opportunities.set_index('symbol')['volume'].to_dict() == pytest.approx({'AAA.NS': 1500.0, 'BBB.NS': 1400.0})
+
+def test_get_trading_opportunities_empty():
+    opportunities = strm.get_trading_opportunities([], 0.2, -0.2, fetch=fake_fetch(FakeProvider({})))
+    assert opportunities.empty
+
+def test_metadata_store_caches_failures_and_batches_saves(tmp_path):
+    calls = []
+    
+    def fetch(symbol):
+        calls.append(symbol)
+        if symbol == 'BAD.NS':
+            raise ValueError('no metadata')
+        return {'company': f"{symbol} Ltd", 'sector': None, 'lot_size': 1}
+    
+    path = str(tmp_path / 'metadata.json')
+    store = strm.MetadataStore(path=path, fetch=fetch, failure_ttl=60, save_interval=60)
+    assert store.get('BAD.NS')['company'] == 'BAD.NS'
+    assert store.get('BAD.NS')['company'] == 'BAD.NS'
+    assert store.get('AAA.NS')['company'] == 'AAA.NS Ltd'
+    assert store.get('AAA.NS')['company'] == 'AAA.NS Ltd'
+    assert calls == ['BAD.NS', 'AAA.NS']
+    assert (store.hits, store.misses) == (2, 2)
+    
+    # The first write lands at once; later ones wait for the save interval or a flush
+    with open(path) as f:
+        assert list(json.load(f)) == ['BAD.NS']
+    store.flush()
+    with open(path) as f:
+        assert set(json.load(f)) == {'BAD.NS', 'AAA.NS'}
+    
+    store.failure_ttl = 0
+    store.get('BAD.NS')
+    assert calls == ['BAD.NS', 'AAA.NS', 'BAD.NS']
+
+def test_quote_cache_single_flight():
+    release = threading.Event()
+    calls = []
+    
+    def fetch(symbol):
+        calls.append(symbol)
+        release.wait(5)
+        return {'symbol': symbol}
+    
+    cache = strm.QuoteCache(fetch=fetch, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('AAA.NS'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while cache.misses + cache.coalesced < 8:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert calls == ['AAA.NS']
+    assert (cache.misses, cache.coalesced) == (1, 7)
+    assert results == [{'symbol': 'AAA.NS'}] * 8
+    assert cache.get('AAA.NS') == {'symbol': 'AAA.NS'} and cache.hits == 1
+
+def test_quote_engine_expires_unwatched_symbols():
+    engine = strm.QuoteEngine(fetch=lambda symbol: {'symbol': symbol, 'last_price': 1.0}, watch_ttl=0.2)
+    engine.watch(['AAA.NS', 'BBB.NS'])
+    engine.refresh()
+    assert set(engine.snapshot()['symbol']) == {'AAA.NS', 'BBB.NS'}
+    
+    time.sleep(0.3)
+    engine.watch(['AAA.NS'])
+    engine.refresh()
+    assert list(engine.snapshot()['symbol']) == ['AAA.NS']
+    assert engine.coverage(['BBB.NS']) == 0
+
+def test_ledger_tracks_open_and_closed_trades():
+    ledger = strm.TradeLedger(balance=30000)
+    long_id = strm.execute_trade('AAA.NS', 'BUY', 100.0, 'AAA', 10000, 5, 10, ledger=ledger)['id']
+    short_id = strm.execute_trade('BBB.NS', 'SELL', 50.0, 'BBB', 10000, 5, 10, ledger=ledger)['id']
+    assert strm.execute_trade('CCC.NS', 'BUY', 10.0, 'CCC', 20000, 5, 10, ledger=ledger) is None
+    assert ledger.balance == 10000 and ledger.open_count == 2
+    
+    assert ledger.close(long_id, 105.0) == pytest.approx(500.0)
+    assert ledger.close(long_id, 105.0) is None
+    assert ledger.balance == pytest.approx(20500.0)
+    assert ledger.get(long_id)['status'] == 'CLOSED'
+    assert list(ledger.open_ids()) == [short_id]
+    assert list(ledger.frame()['status']) == ['CLOSED', 'OPEN']
+
+def test_aggregates_follow_fills_and_marks():
+    ledger = strm.TradeLedger(balance=30000)
+    long_id = strm.execute_trade('AAA.NS', 'BUY', 100.0, 'AAA', 10000, 5, 10, ledger=ledger)['id']
+    strm.execute_trade('BBB.NS', 'SELL', 50.0, 'BBB', 10000, 5, 10, ledger=ledger)
+    
+    prices = {'AAA.NS': 102.0, 'BBB.NS': 49.0}
+    ledger.aggregates.mark_many(prices)
+    marked = strm.mark_to_market(ledger.open_trades(), prices)
+    assert ledger.aggregates.unrealized_pnl == pytest.approx(marked['unrealized_pnl'].sum())
+    assert ledger.aggregates.exposure == {('AAA.NS', 'BUY'): 10000, ('BBB.NS', 'SELL'): 10000}
+    
+    ledger.close(long_id, 105.0)
+    assert ledger.aggregates.realized_pnl == pytest.approx(500.0)
+    assert ledger.aggregates.unrealized_pnl == pytest.approx(200.0)
+    assert ledger.aggregates.held_symbols() == ['BBB.NS']
+    assert ledger.aggregates.open_count == 1
+
+def test_auto_trader_times_orders_from_quote_publish():
+    quote = {'symbol': 'AAA.NS', 'imbalance': 0.9, 'spread_pct': 0.1, 'bid_volume': 1900.0, 'ask_volume': 100.0,
+             'liquidity': 2e5, 'last_price': 100.0, 'company': 'AAA'}
+    engine = strm.QuoteEngine(fetch=lambda symbol: dict(quote))
+    engine.watch(['AAA.NS'])
+    engine.refresh()
+    time.sleep(0.2)
+    
+    ledger = strm.TradeLedger(balance=100000)
+    trader = strm.AutoTrader(ledger, ['AAA.NS'], strm.strategy_params(), engine=engine)
+    trader.tick()
+    trader.tick()
+    assert (trader.orders, ledger.open_count) == (1, 1)
+    # The quote had been waiting in the engine for 200ms before the tick read it
+    assert trader.latency_percentiles()['p50'] >= 200
+
+def test_exit_engine_triggers_only_crossed_levels():
+    exits = strm.ExitEngine()
+    exits.add(0, 'AAA.NS', 'BUY', stop_loss=95.0, take_profit=110.0)
+    exits.add(1, 'AAA.NS', 'SELL', stop_loss=105.0, take_profit=90.0)
+    exits.add(2, 'AAA.NS', 'BUY', stop_loss=90.0, take_profit=120.0)
+    
+    assert exits.on_price('AAA.NS', 100.0) == []
+    assert sorted(exits.on_price('AAA.NS', 94.0)) == [0]
+    exits.remove(2)
+    assert exits.on_price('AAA.NS', 89.0) == [1]
+    assert len(exits) == 0
+    assert exits.on_price('BBB.NS', 1.0) == []
+
+def test_ledger_check_exits_closes_at_the_triggering_price():
+    ledger = strm.TradeLedger(balance=20000)
+    trade_id = strm.execute_trade('AAA.NS', 'BUY', 100.0, 'AAA', 10000, 5, 10, ledger=ledger)['id']
+    assert ledger.check_exits({'AAA.NS': 104.0}) == []
+    assert ledger.check_exits({'AAA.NS': 111.0}) == [trade_id]
+    assert ledger.get(trade_id)['exit_price'] == 111.0
+
+def test_quote_engine_runs_exits_for_unwatched_positions():
+    prices = {'AAA.NS': 100.0}
+    ledger = strm.TradeLedger(balance=20000)
+    trade_id = strm.execute_trade('AAA.NS', 'BUY', 100.0, 'AAA', 10000, 5, 10, ledger=ledger)['id']
+    engine = strm.QuoteEngine(fetch=lambda symbol: {'symbol': symbol, 'last_price': prices[symbol]},
+                              watch_ttl=0, ledgers=lambda: [ledger])
+    
+    # Nobody watches AAA.NS, but the open position keeps it polled
+    engine.refresh()
+    assert list(engine.snapshot()['symbol']) == ['AAA.NS']
+    assert ledger.open_count == 1
+    prices['AAA.NS'] = 94.0
+    engine.refresh()
+    assert ledger.get(trade_id)['exit_price'] == 94.0 and engine.exits == 1
+    assert ledger.aggregates.open_count == 0
+
+def test_run_backtest_takes_profit():
+    index = pd.bdate_range('2024-01-01', periods=4)
+    frame = pd.DataFrame({'Open': 100.0, 'High': 100.0, 'Low': 100.0, 'Close': [100.0, 100.0, 111.0, 111.0],
+                          'imbalance': [0.5, 0.0, 0.0, 0.0]}, index=index)
+    result = strm.run_backtest(strm.align_bars({'AAA.NS': frame}), fee_bps=0, slippage_bps=0)
+    
+    trades = result['trades']
+    assert len(trades) == 1
+    assert (trades.loc[0, 'side'], trades.loc[0, 'exit_time']) == ('BUY', index[2])
+    assert trades.loc[0, 'pnl'] == pytest.approx(1100.0)
+    assert result['equity'].iloc[-1] == pytest.approx(strm.DEFAULT_PARAMS['INITIAL_INVESTMENT'] + 1100.0)
+
+def test_bar_imbalance():
+    imbalance = strm.bar_imbalance(np.array([10.0, 10.0, 10.0, 5.0]), np.array([8.0, 8.0, 8.0, 5.0]),
+                                   np.array([10.0, 8.0, 9.0, 5.0]))
+    assert list(imbalance) == [1.0, -1.0, 0.0, 0.0]
+
+def test_run_sweep_ranks_by_return():
+    index = pd.bdate_range('2024-01-01', periods=6)
+    frame = pd.DataFrame({'Open': 100.0, 'High': 100.0, 'Low': 100.0,
+                          'Close': [100.0, 104.0, 108.0, 112.0, 116.0, 120.0],
+                          'imbalance': [0.5, 0.0, 0.0, 0.0, 0.0, 0.0]}, index=index)
+    results = strm.run_sweep(strm.align_bars({'AAA.NS': frame}), {'take_profit_pct': [5.0, 15.0, 30.0]},
+                             max_workers=2, fee_bps=0, slippage_bps=0)
+    
+    assert list(results['rank']) == [1, 2, 3]
+    assert list(results['take_profit_pct']) == [30.0, 15.0, 5.0]
+    # The widest target never triggers, so that run still holds the position at the top
+    assert results['total_return_pct'].is_monotonic_decreasing
+
+def ohlcv(closes, volumes, start):
+    closes = np.asarray(closes, dtype=float)
+    return pd.DataFrame({'Open': closes, 'High': closes + 0.5, 'Low': closes - 0.5, 'Close': closes,
+                         'Volume': np.asarray(volumes, dtype=float)},
+                        index=pd.date_range(start, periods=len(closes), freq='h'))
+
+def test_bar_store_refreshes_the_forming_bar(tmp_path):
+    store = strm.BarStore(str(tmp_path))
+    assert store.append('AAA.NS', ohlcv([1.0, 2.0, 3.0], [1, 1, 1], '2024-01-01 09:00'), interval='1h') == 3
+    # The last bar comes back grown, followed by one new bar
+    assert store.append('AAA.NS', ohlcv([3.4, 4.0], [9, 1], '2024-01-01 11:00'), interval='1h') == 1
+    
+    stored = store.frame('AAA.NS', interval='1h')
+    assert list(stored['Close']) == [1.0, 2.0, 3.4, 4.0]
+    assert list(stored['Volume']) == [1.0, 1.0, 9.0, 1.0]
+    assert store.append('AAA.NS', ohlcv([1.5], [5], '2024-01-01 10:00'), interval='1h') == 0
+    assert list(store.frame('AAA.NS', interval='1h')['Close']) == [1.0, 2.0, 3.4, 4.0]
+
+def test_bar_store_sync_refetches_from_the_last_bar(tmp_path):
+    class Provider(strm.MarketDataProvider):
+        def __init__(self):
+            self.starts = []
+        
+        def get_history(self, symbol, period='1d', interval='1d', start=None):
+            self.starts.append(start)
+            if start is None:
+                return ohlcv([1.0, 2.0], [1, 1], '2024-01-01 09:00')
+            return ohlcv([2.5, 3.0], [4, 1], '2024-01-01 10:00')
+    
+    store = strm.BarStore(str(tmp_path))
+    provider = Provider()
+    assert store.sync('AAA.NS', provider, interval='1h') == 2
+    assert store.sync('AAA.NS', provider, interval='1h') == 1
+    assert provider.starts[1] == pd.Timestamp('2024-01-01 10:00', tz='UTC')
+    assert list(store.frame('AAA.NS', interval='1h')['Close']) == [1.0, 2.5, 3.0]
+
+def test_journal_snapshot_and_replay_round_trip(tmp_path):
+    path = str(tmp_path / 'trades.db')
+    journal = strm.TradeJournal(path=path, snapshot_every=3)
+    ledger = journal.load_ledger('acct', 100000)
+    ids = [ledger.add(f"S{i}.NS", f"S{i}", 'BUY' if i % 2 else 'SELL', 100.0 + i, 10.0, 1000, 95.0, 110.0 + i)
+           for i in range(5)]
+    journal.flush()  # five events: a snapshot is taken
+    ledger.close(ids[0], 101.0)
+    ledger.close(ids[3], 90.0)
+    journal.flush()  # two events after the snapshot, replayed on load
+    journal.close()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 1
+    
+    restored = strm.TradeJournal(path=path, snapshot_every=3).load_ledger('acct', 100000)
+    assert restored.balance == pytest.approx(ledger.balance)
+    pd.testing.assert_frame_equal(restored.frame(), ledger.frame())
+    assert list(restored.open_ids()) == list(ledger.open_ids())
+    assert restored.aggregates.realized_pnl == pytest.approx(ledger.aggregates.realized_pnl)
+    assert restored.aggregates.exposure == pytest.approx(ledger.aggregates.exposure)
+    assert sorted(restored.exits.on_price('S1.NS', 200.0)) == [1]
+
+def test_ledger_commit_makes_fills_durable_without_a_flush(tmp_path):
+    path = str(tmp_path / 'trades.db')
+    journal = strm.TradeJournal(path=path, flush_interval=3600)
+    ledger = journal.load_ledger('acct', 100000)
+    trade_id = strm.execute_trade('AAA.NS', 'BUY', 100.0, 'AAA', 1000, 5, 10, ledger=ledger)['id']
+    ledger.commit()
+    ledger.commit()  # already durable: no second write
+    
+    # A second connection sees the fill, as a restart after a crash would
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT id, status FROM trades").fetchall() == [(trade_id, 'OPEN')]
+    ledger.close(trade_id, 101.0)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT status FROM trades").fetchall() == [('OPEN',)]
+    ledger.commit()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT status FROM trades").fetchall() == [('CLOSED',)]
+
+def test_query_history_filters_pages_and_sorts(tmp_path):
+    journal = strm.TradeJournal(path=str(tmp_path / 'trades.db'))
+    ledger = journal.load_ledger('acct', 100000)
+    exits = [('AAA.NS', 'BUY', 110.0, '2024-03-01'), ('AAA.NS', 'SELL', 110.0, '2024-03-02'),
+             ('BBB.NS', 'BUY', 90.0, '2024-03-03'), ('BBB.NS', 'BUY', 120.0, '2024-03-04'),
+             ('CCC.NS', 'SELL', 80.0, '2024-03-05')]
+    for symbol, side, exit_price, day in exits:
+        trade_id = ledger.add(symbol, symbol, side, 100.0, 10.0, 1000, 50.0, 200.0)
+        ledger.close(trade_id, exit_price, exit_time=pd.Timestamp(day).to_pydatetime())
+    ledger.add('DDD.NS', 'DDD.NS', 'BUY', 100.0, 10.0, 1000, 50.0, 200.0)
+    
+    frame, total = journal.query_history('acct')
+    assert total == 5 and list(frame['id']) == [4, 3, 2, 1, 0]
+    frame, total = journal.query_history('acct', sort_by='pnl', descending=False, page=1, page_size=2)
+    assert total == 5 and list(frame['pnl']) == [100.0, 200.0]
+    frame, total = journal.query_history('acct', symbol='BBB.NS', pnl_sign=1)
+    assert (total, list(frame['id'])) == (1, [3])
+    frame, total = journal.query_history('acct', side='SELL', start='2024-03-02', end='2024-03-04')
+    assert (total, list(frame['id'])) == (1, [1])
+    assert journal.count_history('acct', side='SELL', start='2024-03-02', end='2024-03-04') == 1
+    assert journal.query_history('acct', count=False)[1] is None
+    assert journal.closed_symbols('acct') == ['AAA.NS', 'BBB.NS', 'CCC.NS']
+    with pytest.raises(ValueError):
+        journal.query_history('acct', sort_by='company')
+    journal.close()
+
+def test_closed_symbols_follow_journal_commits(tmp_path):
+    journal = strm.TradeJournal(path=str(tmp_path / 'trades.db'))
+    ledger = journal.load_ledger('acct', 100000)
+    assert journal.closed_symbols('acct') == []
+    trade_id = ledger.add('ZZZ.NS', 'ZZZ.NS', 'BUY', 100.0, 10.0, 1000, 50.0, 200.0)
+    assert journal.closed_symbols('acct') == []
+    ledger.close(trade_id, 110.0)
+    assert journal.closed_symbols('acct') == ['ZZZ.NS']
+    ledger.reset(100000)
+    assert journal.closed_symbols('acct') == []
+    journal.close()
+
+def test_book_side_keeps_levels_best_first():
+    bids = strm.BookSide(descending=True, depth=2)
+    for price, size in [(99.0, 1), (101.0, 2), (100.0, 3)]:
+        bids.update(price, size)
+    assert bids.levels() == [(101.0, 2.0), (100.0, 3.0), (99.0, 1.0)]
+    assert (bids.best(), bids.volume, bids.weighted) == (101.0, 5.0, 3.5)
+    bids.update(101.0, 0)
+    assert (bids.best(), bids.volume, bids.weighted) == (100.0, 4.0, 3.5)
+
+def top_totals(levels, descending, depth):
+    """Brute-force plain and depth-weighted size of the best ``depth`` levels"""
+    best = sorted(levels, key=lambda level: level[0], reverse=descending)[:depth]
+    return sum(size for _, size in best), sum((1 - i / depth) * size for i, (_, size) in enumerate(best))
+
+def test_recorded_depth_replay_matches_brute_force():
+    with open(DEPTH_FIXTURE) as f:
+        records = [json.loads(line) for line in f]
+    feed = strm.OrderBookFeed(strm.RecordedDepthSource(DEPTH_FIXTURE, speed=0), depth=5)
+    replayed = 0
+    for (symbol, bids, asks, timestamp), record in zip(feed.source.snapshots(), records):
+        feed.apply(symbol, bids, asks, timestamp)
+        book = feed.books[symbol]
+        for side, levels, descending in ((book.bids, record['bids'], True), (book.asks, record['asks'], False)):
+            assert side.levels() == sorted(map(tuple, levels), reverse=descending)
+            volume, weighted = top_totals(levels, descending, 5)
+            assert (side.volume, side.weighted) == (pytest.approx(volume), pytest.approx(weighted))
+        depth = feed.depth(symbol)
+        assert depth['bid_volume'] == pytest.approx(book.bids.volume)
+        assert -1 <= depth['imbalance'] <= 1 and depth['spread_pct'] > 0
+        replayed += 1
+    assert replayed == len(records) == feed.updates
+    assert feed.depth('ZZZ.NS') is None
+
+def test_book_side_random_updates_match_brute_force():
+    rng = np.random.default_rng(1)
+    for descending in (True, False):
+        side = strm.BookSide(descending=descending, depth=5)
+        levels = {}
+        for _ in range(2000):
+            price = round(100 + 0.05 * int(rng.integers(-40, 40)), 2)
+            size = float(rng.integers(0, 20)) if rng.random() < 0.7 else 0.0
+            side.update(price, size)
+            if size > 0:
+                levels[price] = size
+            else:
+                levels.pop(price, None)
+            volume, weighted = top_totals(levels.items(), descending, 5)
+            assert side.volume == pytest.approx(volume)
+            assert side.weighted == pytest.approx(weighted)
+        assert side.levels() == sorted(levels.items(), reverse=descending)
+
+def test_rolling_bars_match_brute_force():
+    rng = np.random.default_rng(0)
+    window = 10
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 37)))
+    high = close * (1 + rng.uniform(0, 0.01, 37))
+    low = close * (1 - rng.uniform(0, 0.01, 37))
+    volume = rng.uniform(100, 1000, 37)
+    returns = np.concatenate([[0.0], np.diff(np.log(close))])
+    
+    bars = strm.RollingBars(window)
+    for i in range(37):
+        bars.push(i, high[i], low[i], close[i], volume[i])
+        recent = slice(max(0, i + 1 - window), i + 1)
+        typical = (high[recent] + low[recent] + close[recent]) / 3
+        features = bars.features()
+        assert features['vwap'] == pytest.approx(typical @ volume[recent] / volume[recent].sum())
+        assert features['volatility_pct'] == pytest.approx(np.sqrt(returns[recent] @ returns[recent]) * 100)
+        assert features['range_pct'] == pytest.approx((high[recent].max() - low[recent].min()) / close[i] * 100)
+        expected_z = (volume[i] - volume[recent].mean()) / volume[recent].std() if i else 0.0
+        assert features['volume_z'] == pytest.approx(expected_z)
+
+def test_intraday_features_replace_a_forming_bar():
+    def frame(rows):
+        index = pd.DatetimeIndex([pd.Timestamp('2024-01-01 09:15') + pd.Timedelta(minutes=m) for m, *_ in rows])
+        return pd.DataFrame([row[1:] for row in rows], index=index, columns=['High', 'Low', 'Close', 'Volume'])
+    
+    final = [(0, 101.0, 99.0, 100.0, 500.0), (1, 102.0, 100.0, 101.0, 400.0), (2, 104.0, 97.0, 98.0, 900.0),
+             (3, 99.0, 97.5, 98.5, 300.0)]
+    expected = strm.RollingBars(window=3)
+    for minute, *bar in final:
+        expected.push(pd.Timestamp('2024-01-01 09:15') + pd.Timedelta(minutes=minute), *bar)
+    
+    features = strm.IntradayFeatures(window=3)
+    features.ingest('AAA.NS', frame(final[:2] + [(2, 100.5, 99.5, 100.0, 200.0)]))
+    # The forming bar widens, then a shrinking revision forces a deque rebuild
+    features.ingest('AAA.NS', frame([(2, 103.0, 98.0, 99.0, 600.0)]))
+    features.ingest('AAA.NS', frame([final[2], (3, 99.5, 97.0, 98.0, 100.0)]))
+    features.ingest('AAA.NS', frame([final[3]]))
+    assert features.ingest('AAA.NS', frame([final[3]])) == pytest.approx(expected.features())
+
+def test_quote_cache_serves_stale_quote_on_failure():
+    responses = [{'price': 1}, RuntimeError('upstream down')]
+    
+    def fetch(symbol):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    
+    cache = strm.QuoteCache(fetch=fetch, ttl=0)
+    assert cache.get('AAA.NS') == {'price': 1}
+    assert cache.get('AAA.NS') == {'price': 1}
+    assert cache.stale == 1
+
+def test_fetch_scheduler_dispatches_positions_first():
+    calls = []
+    scheduler = strm.FetchScheduler(lambda symbol: calls.append(symbol) or symbol, rate=20, burst=1, max_workers=1)
+    scheduler.prioritize(['HELD.NS'])
+    futures = [scheduler.submit(symbol) for symbol in ['W1.NS', 'W2.NS', 'W3.NS', 'HELD.NS']]
+    assert [future.result(5) for future in futures] == ['W1.NS', 'W2.NS', 'W3.NS', 'HELD.NS']
+    # W1.NS may take the burst token before the rest are queued; HELD.NS still beats W2.NS and W3.NS
+    assert calls.index('HELD.NS') < calls.index('W2.NS')
+
+def test_fetch_scheduler_keeps_to_its_rate():
+    scheduler = strm.FetchScheduler(lambda symbol: symbol, rate=20, burst=2)
+    start = time.monotonic()
+    for future in [scheduler.submit(f"S{i}.NS") for i in range(10)]:
+        future.result(5)
+    # Two burst tokens, then eight more at 20/s
+    assert time.monotonic() - start >= 0.35
+
+def test_fetch_scheduler_backs_off_failing_symbols():
+    calls = []
+    
+    def upstream(symbol):
+        calls.append(symbol)
+        raise ValueError('bad symbol')
+    
+    scheduler = strm.FetchScheduler(upstream, backoff_base=60)
+    with pytest.raises(ValueError):
+        scheduler.fetch('BAD.NS')
+    with pytest.raises(strm.UpstreamBackoff):
+        scheduler.fetch('BAD.NS')
+    assert calls == ['BAD.NS']
+    assert scheduler.stats()['backing_off'] == 1
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"{status_code} Client Error")
+        self.response = SimpleNamespace(status_code=status_code)
+
+def test_fetch_scheduler_rate_limit_fails_queued_fetches():
+    def upstream(symbol):
+        time.sleep(0.05)
+        raise HTTPError(429)
+    
+    scheduler = strm.FetchScheduler(upstream, rate=1, burst=1, max_workers=1)
+    futures = [scheduler.submit(symbol) for symbol in ['A.NS', 'B.NS', 'C.NS']]
+    assert isinstance(futures[0].exception(5), HTTPError)
+    assert all(isinstance(future.exception(1), strm.UpstreamBackoff) for future in futures[1:])
+    with pytest.raises(strm.UpstreamBackoff):
+        scheduler.fetch('D.NS')
+
+def test_rate_limit_detection_ignores_message_text():
+    assert strm._is_rate_limited(HTTPError(429))
+    assert not strm._is_rate_limited(HTTPError(404))
+    assert not strm._is_rate_limited(RuntimeError("No data for 429.NS"))
+    assert not strm._is_rate_limited(RuntimeError("Too Many Requests"))
+
+@pytest.mark.skipif(strm._YF_RATE_LIMIT_ERROR == (), reason="yfinance release without YFRateLimitError")
+def test_rate_limit_detection_knows_yfinance_error():
+    assert strm._is_rate_limited(strm._YF_RATE_LIMIT_ERROR())
+
+def test_fetch_scheduler_zero_rate_and_timeout():
+    with pytest.raises(strm.UpstreamBackoff):
+        strm.FetchScheduler(lambda symbol: symbol, rate=0).fetch('A.NS')
+    
+    scheduler = strm.FetchScheduler(lambda symbol: symbol, rate=0.001, burst=1, wait=0.2)
+    assert scheduler.fetch('A.NS') == 'A.NS'
+    with pytest.raises(strm.UpstreamBackoff):
+        scheduler.fetch('B.NS')
+    assert scheduler.stats()['queued'] == 0